@@ -0,0 +1,141 @@
+import sys
+import time
+import argparse
+import multiprocessing
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+from pubsub import pub
+
+from ImageScrapper import ImageScrapper
+from HttpPool import configureHttpPool
+from HttpPool import getHostPoolSizes
+from HttpPool import parseHostPoolSize
+from HttpPool import DEFAULT_POOL_SIZE
+from BrowserPool import getBrowserPool
+from SearchEngines import SEARCH_ENGINES
+from ScrapeJob import readJobsFromFile
+from ScrapeJob import getDownloadArgs
+
+# Settings
+DEFAULT_CONCURRENCY = max(1, multiprocessing.cpu_count() // 2)
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_SHARD_WORKERS = 0 # jobs aren't sharded by default, see QueryShards
+DEFAULT_DIR_LEVELS = 0 # images are saved directly to save dir by default
+PROGRESS_PRINT_INTERVAL = 2 # seconds between aggregated progress lines
+
+# Worker process state: one ImageScrapper environment (and one headless browser) per process
+def _initWorker(pool_size, host_pool_sizes):
+    # close browser when worker process exits (atexit isn't called in pool workers)
+    util.Finalize(None, getBrowserPool().close, exitpriority=10)
+    configureHttpPool(pool_size, host_pool_sizes)
+
+def _runJob(job_index, download_args, download_workers, shard_workers, dir_levels, progress_queue):
+    def onDownloadProgressChanged(progress):
+        progress_queue.put((job_index, progress))
+
+    # pubsub keeps weak references, listener lives until job is finished
+    pub.subscribe(onDownloadProgressChanged, 'downloadProgressChanged')
+    try:
+        start_time = time.monotonic()
+        image_scrapper = ImageScrapper(download_workers=download_workers, browser_pool=getBrowserPool(), shard_workers=shard_workers, dir_levels=dir_levels)
+        downloaded_images_count = image_scrapper.downloadImages(**download_args)
+        return downloaded_images_count, time.monotonic() - start_time
+    finally:
+        pub.unsubscribe(onDownloadProgressChanged, 'downloadProgressChanged')
+
+def loadJobs(paths):
+    jobs = []
+    for path in paths:
+        for input_values in readJobsFromFile(path):
+            jobs.append((path, input_values))
+    return jobs
+
+def printProgress(progress, jobs_count, finished_count):
+    total_progress = sum(progress.values()) // max(1, jobs_count)
+    print(f"Progress: {total_progress}% ({finished_count}/{jobs_count} jobs finished)")
+
+def printSummary(results, total_time):
+    print("Summary:")
+    total_images = 0
+    failed_count = 0
+
+    for (path, input_values), result in results:
+        if isinstance(result, Exception) or result[0] is None:
+            failed_count += 1
+            print(f"  FAILED  {input_values.get('search_query')!r} ({path}): {result if isinstance(result, Exception) else 'download error'}")
+        else:
+            total_images += result[0]
+            print(f"  OK      {input_values.get('search_query')!r} ({path}): {result[0]} images in {result[1]:.1f}s")
+
+    print(f"Total: {total_images} images, {len(results) - failed_count}/{len(results)} jobs succeeded in {total_time:.1f}s")
+    return failed_count
+
+def runJobs(jobs, concurrency=DEFAULT_CONCURRENCY, download_workers=DEFAULT_DOWNLOAD_WORKERS, shard_workers=DEFAULT_SHARD_WORKERS, dir_levels=DEFAULT_DIR_LEVELS,
+            pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None):
+    start_time = time.monotonic()
+    results = [None] * len(jobs)
+    futures = {}
+    progress = {}
+
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+
+        with ProcessPoolExecutor(max_workers=concurrency, initializer=_initWorker, initargs=(pool_size, getHostPoolSizes(host_pool_sizes))) as executor:
+            for job_index, (path, input_values) in enumerate(jobs):
+                try:
+                    download_args = getDownloadArgs(input_values, SEARCH_ENGINES)
+                except ValueError as ex:
+                    results[job_index] = ex
+                    continue
+
+                progress[job_index] = 0
+                futures[executor.submit(_runJob, job_index, download_args, download_workers, shard_workers, dir_levels, progress_queue)] = job_index
+
+            last_print_time = 0
+            while any(not future.done() for future in futures):
+                try:
+                    job_index, job_progress = progress_queue.get(timeout=0.5)
+                    progress[job_index] = job_progress
+                except Empty:
+                    pass
+
+                if time.monotonic() - last_print_time >= PROGRESS_PRINT_INTERVAL:
+                    printProgress(progress, len(futures), sum(future.done() for future in futures))
+                    last_print_time = time.monotonic()
+
+            # progress messages sent right before jobs finished
+            while not progress_queue.empty():
+                job_index, job_progress = progress_queue.get()
+                progress[job_index] = job_progress
+
+            printProgress(progress, len(futures), len(futures))
+            for future, job_index in futures.items():
+                try:
+                    results[job_index] = future.result()
+                except Exception as ex:
+                    results[job_index] = ex
+
+    return list(zip(jobs, results)), time.monotonic() - start_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download images for many jobs in parallel worker processes without GUI")
+    parser.add_argument("jobs", nargs="+", help=".iss project files or .jsonl files with one job per line")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="amount of worker processes (each with own browser)")
+    parser.add_argument("-w", "--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="download threads per worker process")
+    parser.add_argument("-s", "--shard-workers", type=int, default=DEFAULT_SHARD_WORKERS, help="split every query into shards run by this amount of threads (0 - single query)")
+    parser.add_argument("--dir-levels", type=int, default=DEFAULT_DIR_LEVELS, help="save images to this many levels of hash prefix subdirectories (0 - directly to save dir)")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="kept-alive connections per image host")
+    parser.add_argument("--host-pool-size", nargs="+", type=parseHostPoolSize, default=[], metavar="HOST=SIZE", help="kept-alive connections of hosts which serve many images")
+    args = parser.parse_args(argv)
+
+    jobs = loadJobs(args.jobs)
+    print(f"Loaded {len(jobs)} jobs, running {args.concurrency} at a time")
+
+    results, total_time = runJobs(jobs, args.concurrency, args.download_workers, args.shard_workers, args.dir_levels, args.pool_size, args.host_pool_size)
+    failed_count = printSummary(results, total_time)
+    return 1 if failed_count else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,527 @@
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+from PIL import Image
+from PIL import ImageFile
+from pubsub import pub
+
+# psutil is optional, without it peak memory is measured by python allocations only
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from SearchEngines import SEARCH_ENGINES
+from SearchEngines import isHttpSearchEngine
+from SearchEngines import readImageResolution
+from SearchEngines import IMAGE_CHUNK_SIZE
+from ImageProbe import ImageSizeReader
+from HttpPool import getSession
+from ImageScrapper import ImageScrapper
+from BrowserPool import BrowserPool
+from HostScheduler import configureHostScheduler
+from Metrics import getRunMetrics
+from Metrics import getPercentile
+
+# Settings
+DEFAULT_CORPUS_SIZE = 200
+DEFAULT_IMAGES_COUNT = 100
+DEFAULT_IMAGE_SIZES = ["800x600", "1280x720", "1920x1080"]
+DEFAULT_IMAGE_FORMATS = ["jpeg", "png"]
+DEFAULT_ENGINES = ["DuckDuckGo HTTP"]
+DEFAULT_DOWNLOAD_WORKERS = [0, 4]
+RESULTS_PAGE_SIZE = 50 # thumbnails added to result page per scroll (and results per json page)
+RESULTS_PAGES_BEFORE_LOAD_MORE = 3 # pages loaded by scrolling before "load more" button has to be clicked
+MEMORY_SAMPLE_INTERVAL = 0.1
+DEFAULT_HOST_RATE = 1000 # all images come from one local host, its limits shouldn't be the bottleneck
+DEFAULT_HOST_CONCURRENCY = 32
+REPORTED_STAGES = ["download", "host_wait", "image_download", "image_request", "image_write", "preview", "click", "scroll", "extract", "search_page"]
+
+# Result page with thumbnails which are added on scroll, full image is shown after thumbnail click.
+# Google page also embeds image data the way bulk extraction expects it
+RESULT_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><style>
+.thumb { display: inline-block; width: 180px; height: 180px; margin: 4px; }
+.thumb img { width: 180px; height: 180px; }
+#more { display: none; }
+</style></head>
+<body>
+<div id="results"></div>
+<input id="more" class="%(load_more_class)s" type="button" value="Show more results">
+<div id="preview"></div>
+<script>
+var ENGINE = "%(engine)s";
+var ITEMS = %(items)s;
+var PAGE_SIZE = %(page_size)d;
+var PAGES_BEFORE_LOAD_MORE = %(pages_before_load_more)d;
+var shown = 0, pages = 0;
+
+function dataScript(start, end) {
+    var entries = [];
+    for (var i = start; i < end; i++) {
+        var item = ITEMS[i];
+        entries.push('[0,"' + item.id + '",["https://encrypted-tbn0.gstatic.com/images?q=tbn:' + item.id + '",180,180],["' + item.url + '",' + item.height + ',' + item.width + ']]');
+    }
+    var script = document.createElement("script");
+    script.type = "text/plain";
+    script.textContent = "AF_initDataCallback({data:[" + entries.join(",") + "]});";
+    document.body.appendChild(script);
+}
+
+function showPreview(item) {
+    var preview = document.getElementById("preview");
+    if (ENGINE == "Google") {
+        preview.innerHTML = '<img class="n3VNCb" src="' + item.url + '"><span class="VSIspc">' + item.width + ' × ' + item.height + '</span>';
+    } else {
+        preview.innerHTML = '<a class="detail__media__img-link" href="' + item.url + '">open</a><div class="c-detail__filemeta">' + item.width + ' × ' + item.height + '</div>';
+    }
+}
+
+function addPage() {
+    var results = document.getElementById("results");
+    var end = Math.min(shown + PAGE_SIZE, ITEMS.length);
+    if (ENGINE == "Google") {
+        dataScript(shown, end);
+    }
+    for (var i = shown; i < end; i++) {
+        var container = document.createElement("div");
+        container.className = "thumb";
+        container.setAttribute("data-id", ITEMS[i].id);
+        var img = document.createElement("img");
+        img.className = "%(thumbnail_class)s";
+        img.src = "/thumbnail.png";
+        img.onclick = showPreview.bind(null, ITEMS[i]);
+        container.appendChild(img);
+        results.appendChild(container);
+    }
+    shown = end;
+    pages += 1;
+    document.getElementById("more").style.display = (shown < ITEMS.length && pages %% PAGES_BEFORE_LOAD_MORE == 0) ? "block" : "none";
+}
+
+document.getElementById("more").onclick = function() {
+    this.style.display = "none";
+    addPage();
+};
+
+window.onscroll = function() {
+    var at_end = window.innerHeight + window.scrollY >= document.body.scrollHeight - 10;
+    if (at_end && shown < ITEMS.length && pages %% PAGES_BEFORE_LOAD_MORE != 0) {
+        addPage();
+    }
+};
+
+addPage();
+</script>
+</body></html>
+"""
+
+# Generated images which are served by fake image host, every image has different content
+class ImageCorpus:
+    def __init__(self, count, sizes, formats, seed=0):
+        rng = random.Random(seed)
+        self.items = []
+        self._data = {}
+
+        for index in range(count):
+            width, height = sizes[index % len(sizes)]
+            image_format = formats[index % len(formats)]
+            # random 8x8 colors scaled up, so images aren't perceptual duplicates of each other
+            image = Image.frombytes("RGB", (8, 8), bytes(rng.getrandbits(8) for _ in range(8 * 8 * 3))).resize((width, height), Image.BILINEAR)
+
+            buffer = io.BytesIO()
+            image.save(buffer, image_format.upper())
+            name = f"{index}.{image_format}"
+            self._data[name] = (buffer.getvalue(), "image/" + image_format)
+            self.items.append({"id": f"img{index}", "name": name, "width": width, "height": height})
+
+    def get(self, name):
+        return self._data.get(name)
+
+# Local http server which pretends to be search engines (browser pages and DuckDuckGo json api) and image host
+# query_cap - like real engines, return at most this amount of results for one query (0 - whole corpus),
+# different queries and filters get different windows of corpus
+class FakeSearchServer:
+    def __init__(self, corpus, latency=0.0, error_rate=0.0, seed=0, query_cap=0):
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.query_cap = query_cap
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        thumbnail = io.BytesIO()
+        Image.new("RGB", (32, 32), (128, 128, 128)).save(thumbnail, "PNG")
+        self._thumbnail = thumbnail.getvalue()
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and small bodies are written separately, don't let them wait for acks
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    # client closed kept-alive connection or aborted download
+                    pass
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Points search engines to this server (only in benchmark process)
+    def patchSearchEngines(self):
+        SEARCH_ENGINES["Google"]["search_url"] = self.base_url + "/google?q={q}{filter}"
+        SEARCH_ENGINES["DuckDuckGo"]["search_url"] = self.base_url + "/duckduckgo?q={q}{filter}"
+        SEARCH_ENGINES["DuckDuckGo HTTP"]["search_url"] = self.base_url + "/duckduckgo-http?q={q}"
+        SEARCH_ENGINES["DuckDuckGo HTTP"]["api_url"] = self.base_url + "/i.js?q={q}&vqd={vqd}&f={filter}"
+
+    # Results of query: query with filter is the key of its window of corpus
+    def _getItems(self, query=None):
+        items = [dict(item, url=f"{self.base_url}/images/{item['name']}") for item in self.corpus.items]
+        if not self.query_cap or self.query_cap >= len(items):
+            return items
+
+        key = "&".join(f"{name}={value}" for name, values in sorted((query or {}).items()) if name not in ("s", "vqd") for value in values)
+        start = zlib.crc32(key.encode("utf-8")) % len(items)
+        return (items[start:] + items[:start])[:self.query_cap]
+
+    def _isFailed(self):
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+    def _handle(self, request):
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+
+        if url.path in ("/google", "/duckduckgo"):
+            engine = "Google" if url.path == "/google" else "DuckDuckGo"
+            selectors = SEARCH_ENGINES[engine]["selectors"]
+            page = RESULT_PAGE_TEMPLATE % {
+                "engine": engine,
+                "items": json.dumps(self._getItems(query)),
+                "page_size": RESULTS_PAGE_SIZE,
+                # engines without "load more" button get new thumbnails only by scrolling
+                "pages_before_load_more": RESULTS_PAGES_BEFORE_LOAD_MORE if selectors.get("load_more") else len(self.corpus.items) + 1,
+                "thumbnail_class": selectors["thumbnail"].split(".", 1)[1],
+                "load_more_class": selectors.get("load_more", "input.none").split(".", 1)[1]
+            }
+            self._send(request, page.encode("utf-8"), "text/html; charset=utf-8")
+        elif url.path == "/duckduckgo-http":
+            self._send(request, b"<html><script>vqd='4-0123456789'</script></html>", "text/html")
+        elif url.path == "/i.js":
+            start = int(query.get("s", ["0"])[0])
+            items = self._getItems(query)
+            data = {"results": [{"image": item["url"], "width": item["width"], "height": item["height"]} for item in items[start:start + RESULTS_PAGE_SIZE]]}
+            if start + RESULTS_PAGE_SIZE < len(items):
+                data["next"] = "i.js?" + urlencode({"q": query.get("q", [""])[0], "f": query.get("f", [""])[0], "s": start + RESULTS_PAGE_SIZE})
+            self._send(request, json.dumps(data).encode("utf-8"), "application/json")
+        elif url.path == "/thumbnail.png":
+            self._send(request, self._thumbnail, "image/png")
+        elif url.path.startswith("/images/"):
+            if self.latency:
+                time.sleep(self.latency)
+            image = self.corpus.get(url.path[len("/images/"):])
+            if not image or self._isFailed():
+                self._send(request, b"error", "text/plain", 503)
+            else:
+                self._send(request, image[0], image[1])
+        else:
+            self._send(request, b"not found", "text/plain", 404)
+
+    def _send(self, request, body, content_type, status=200):
+        try:
+            request.send_response(status)
+            request.send_header("Content-Type", content_type)
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # client aborted download (e.g. image was rejected by resolution)
+            pass
+
+# Peak memory of benchmark process (and browser started by it) while run is active
+class MemorySampler:
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.peak_mb = 0.0
+
+    def start(self):
+        if not psutil:
+            tracemalloc.start()
+        self._thread.start()
+
+    # Returns peak memory in MB
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        if not psutil:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        return self.peak_mb
+
+    def _run(self):
+        if not psutil:
+            return
+
+        process = psutil.Process()
+        while not self._stopped.wait(self._interval):
+            try:
+                processes = [process] + process.children(recursive=True)
+                self.peak_mb = max(self.peak_mb, sum(p.memory_info().rss for p in processes) / (1024 * 1024))
+            except psutil.Error:
+                continue
+
+def runBenchmark(search_engine, download_workers, images_count, browser_pool=None, bulk_extract=True, windowed_scroll=True, shard_workers=0):
+    image_times = []
+    start_time = time.monotonic()
+
+    def onDownloadProgressChanged(progress):
+        image_times.append(time.monotonic() - start_time)
+
+    save_dir = tempfile.mkdtemp(prefix="ImageScrapperBenchmark")
+    memory_sampler = MemorySampler()
+    pub.subscribe(onDownloadProgressChanged, 'downloadProgressChanged')
+    try:
+        memory_sampler.start()
+        start_time = time.monotonic()
+        # fresh run: no url index, no resume, every image is downloaded
+        image_scrapper = ImageScrapper(download_workers=download_workers, bulk_extract=bulk_extract, browser_pool=browser_pool, url_index_path=None, resume=False,
+            windowed_scroll=windowed_scroll, shard_workers=shard_workers)
+        downloaded_images_count = image_scrapper.downloadImages("benchmark", search_engine, images_count, (1, 1), (10000, 10000), ["image/jpeg", "image/png", "image/gif", "image/webp"], save_dir)
+        run_time = time.monotonic() - start_time
+    finally:
+        peak_memory_mb = memory_sampler.stop()
+        pub.unsubscribe(onDownloadProgressChanged, 'downloadProgressChanged')
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    snapshot = getRunMetrics().getSnapshot()
+    image_intervals = sorted(later - earlier for earlier, later in zip([0.0] + image_times, image_times))
+    return {
+        "search_engine": search_engine,
+        "download_workers": download_workers,
+        "bulk_extract": bulk_extract,
+        "windowed_scroll": windowed_scroll,
+        "shard_workers": shard_workers,
+        "downloaded_images_count": downloaded_images_count or 0,
+        "run_time": run_time,
+        "images_per_second": (downloaded_images_count or 0) / run_time if run_time > 0 else 0.0,
+        "bytes_per_second": snapshot["downloaded_bytes"] / run_time if run_time > 0 else 0.0,
+        "first_image_time": image_times[0] if image_times else None,
+        "image_interval_p50": getPercentile(image_intervals, 50),
+        "image_interval_p90": getPercentile(image_intervals, 90),
+        "image_interval_p99": getPercentile(image_intervals, 99),
+        "peak_memory_mb": peak_memory_mb,
+        "peak_memory_source": "rss" if psutil else "python",
+        "stages": {stage: snapshot["stages"][stage] for stage in REPORTED_STAGES if stage in snapshot["stages"]},
+        "outcomes": snapshot["outcomes"],
+        "http_pool": snapshot["http_pool"]
+    }
+
+def printResult(result):
+    print(f"{result['search_engine']!r}, workers {result['download_workers']}: "
+          f"{result['downloaded_images_count']} images in {result['run_time']:.2f}s, "
+          f"{result['images_per_second']:.1f} images/s, {result['bytes_per_second'] / (1024 * 1024):.1f} MB/s, "
+          f"peak memory {result['peak_memory_mb']:.0f} MB ({result['peak_memory_source']})")
+    print(f"    time between images p50 {result['image_interval_p50'] * 1000:.0f}ms, p90 {result['image_interval_p90'] * 1000:.0f}ms, p99 {result['image_interval_p99'] * 1000:.0f}ms")
+    for stage, stats in result["stages"].items():
+        print(f"    {stage}: p50 {stats['p50_time'] * 1000:.0f}ms, p90 {stats['p90_time'] * 1000:.0f}ms, p99 {stats['p99_time'] * 1000:.0f}ms ({stats['count']} times)")
+    print(f"    outcomes: {result['outcomes']}")
+    print(f"    http pool: {result['http_pool']['requests']} requests, {result['http_pool']['hits']} hits, {result['http_pool']['misses']} misses")
+
+# Resolution probe before native header parser: whole response is streamed in 1 KB chunks into PIL parser
+def readResolutionWithPil(url):
+    with getSession().get(url, stream=True) as response:
+        parser = ImageFile.Parser()
+        for data in response.iter_content(1024):
+            parser.feed(data)
+            if parser.image:
+                return parser.image.size
+    return None
+
+# Resolution probe of download path: native header parser fed with first chunks of the response which is saved
+def readResolutionWithReader(url):
+    with getSession().get(url, stream=True) as response:
+        return readImageResolution(response.iter_content(IMAGE_CHUNK_SIZE))[0]
+
+def _measure(function, arguments_list):
+    times = []
+    for arguments in arguments_list:
+        start_time = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start_time)
+    return sorted(times)
+
+def _parseWithReader(data):
+    reader = ImageSizeReader()
+    for start in range(0, len(data), 16 * 1024):
+        if reader.feed(data[start:start + 16 * 1024]):
+            return reader.size
+    return None
+
+def _parseWithPil(data):
+    parser = ImageFile.Parser()
+    for start in range(0, len(data), 1024):
+        parser.feed(data[start:start + 1024])
+        if parser.image:
+            return parser.image.size
+    return None
+
+# Compares native header parser with PIL parser, both on image data and on streamed response
+def runProbeBenchmark(corpus, server, repeats=3):
+    datas = [(corpus.get(item["name"])[0],) for item in corpus.items] * repeats
+    urls = [(f"{server.base_url}/images/{item['name']}",) for item in corpus.items]
+
+    results = {
+        "parse_native": _measure(_parseWithReader, datas),
+        "parse_pil": _measure(_parseWithPil, datas),
+        "http_stream_pil": _measure(readResolutionWithPil, urls * repeats),
+        "http_stream_native": _measure(readResolutionWithReader, urls * repeats)
+    }
+
+    report = {}
+    for name, times in results.items():
+        report[name] = {
+            "count": len(times),
+            "avg_us": sum(times) / len(times) * 1000000,
+            "p50_us": getPercentile(times, 50) * 1000000,
+            "p90_us": getPercentile(times, 90) * 1000000,
+        }
+        print(f"{name}: avg {report[name]['avg_us']:.0f}us, p50 {report[name]['p50_us']:.0f}us, p90 {report[name]['p90_us']:.0f}us ({len(times)} probes)")
+    return report
+
+# Returns descriptions of results which are slower than baseline by more than max_slowdown (0.1 = 10%)
+def findRegressions(results, baseline_results, max_slowdown):
+    def getKey(r):
+        # baselines from before windowed scrolling used it implicitly
+        return r["search_engine"], r["download_workers"], r["bulk_extract"], r.get("windowed_scroll", True), r.get("shard_workers", 0)
+
+    baseline = {getKey(r): r for r in baseline_results}
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get(getKey(result))
+        if not baseline_result or not baseline_result["images_per_second"]:
+            continue
+        if result["images_per_second"] < baseline_result["images_per_second"] * (1 - max_slowdown):
+            regressions.append(f"{result['search_engine']!r}, workers {result['download_workers']}: "
+                               f"{result['images_per_second']:.1f} images/s, baseline {baseline_result['images_per_second']:.1f} images/s")
+    return regressions
+
+# Same for results of probe benchmark (dict of probe name -> times), median time is compared
+def findProbeRegressions(results, baseline_results, max_slowdown):
+    regressions = []
+    for name, result in results.items():
+        baseline_result = baseline_results.get(name)
+        if not baseline_result or not baseline_result["p50_us"]:
+            continue
+        if result["p50_us"] > baseline_result["p50_us"] * (1 + max_slowdown):
+            regressions.append(f"{name}: p50 {result['p50_us']:.0f}us, baseline {baseline_result['p50_us']:.0f}us")
+    return regressions
+
+def parseSize(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure ImageScrapper throughput against local fake search engine and image host")
+    parser.add_argument("-e", "--engines", nargs="+", default=DEFAULT_ENGINES, choices=list(SEARCH_ENGINES), help="search engines to benchmark (browser engines need Chrome)")
+    parser.add_argument("-w", "--download-workers", nargs="+", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="download workers counts to compare (0 - browser thread downloads)")
+    parser.add_argument("-n", "--images", type=int, default=DEFAULT_IMAGES_COUNT, help="images to download per run")
+    parser.add_argument("--corpus", type=int, default=DEFAULT_CORPUS_SIZE, help="amount of images served by fake host")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_IMAGE_SIZES, help="image sizes, e.g. 1920x1080")
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_IMAGE_FORMATS, help="image formats supported by PIL, e.g. jpeg png gif webp")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds fake host waits before every image response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="part of image requests answered with 503 (overloaded host)")
+    parser.add_argument("--host-rate", type=float, default=DEFAULT_HOST_RATE, help="max requests per second to image host")
+    parser.add_argument("--host-concurrency", type=int, default=DEFAULT_HOST_CONCURRENCY, help="max requests in flight to image host")
+    parser.add_argument("--probe", action="store_true", help="only compare resolution probe implementations")
+    parser.add_argument("--click", action="store_true", help="click every thumbnail instead of bulk extraction")
+    parser.add_argument("--full-scan", action="store_true", help="query all thumbnails after every scroll instead of only unprocessed ones")
+    parser.add_argument("--query-cap", type=int, default=0, help="max results fake engine returns for one query (0 - whole corpus)")
+    parser.add_argument("--shard-workers", type=int, default=0, help="split query into shards run by this amount of threads (0 - single query)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write results to json file")
+    parser.add_argument("--baseline", help="json file with results of previous benchmark to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="allowed throughput drop against baseline")
+    args = parser.parse_args(argv)
+
+    print(f"Generating {args.corpus} images ...")
+    corpus = ImageCorpus(args.corpus, [parseSize(size) for size in args.sizes], args.formats, args.seed)
+    server = FakeSearchServer(corpus, args.latency, args.error_rate, args.seed, args.query_cap)
+    server.start()
+    server.patchSearchEngines()
+    configureHostScheduler(rate=args.host_rate, burst=args.host_rate, max_concurrency=args.host_concurrency)
+
+    browser_pool = None
+    results = []
+    try:
+        if args.probe:
+            results = runProbeBenchmark(corpus, server)
+            args.engines = []
+
+        for search_engine in args.engines:
+            if not isHttpSearchEngine(search_engine) and not browser_pool:
+                browser_pool = BrowserPool(headless=True)
+
+            for download_workers in args.download_workers:
+                result = runBenchmark(search_engine, download_workers, args.images, browser_pool, not args.click, not args.full_scan, args.shard_workers)
+                printResult(result)
+                results.append(result)
+    finally:
+        if browser_pool:
+            browser_pool.close()
+        server.close()
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=4)
+
+    if args.baseline:
+        with io.open(args.baseline, 'r', encoding='utf-8') as baseline:
+            baseline_results = json.load(baseline)
+        # probe results are dict, throughput results are list
+        if isinstance(baseline_results, dict) != args.probe:
+            print(f"Baseline {args.baseline} isn't result of " + ("--probe" if args.probe else "throughput") + " benchmark")
+            return 2
+        if args.probe:
+            regressions = findProbeRegressions(results, baseline_results, args.max_slowdown)
+        else:
+            regressions = findRegressions(results, baseline_results, args.max_slowdown)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
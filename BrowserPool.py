@@ -0,0 +1,188 @@
+import threading
+from collections import deque
+
+# psutil is optional, without it drivers aren't recycled by memory usage
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Settings
+DEFAULT_POOL_SIZE = 1
+DEFAULT_MAX_JOBS_PER_DRIVER = 20 # driver is recreated after this amount of jobs
+DEFAULT_MAX_MEMORY_MB = 1024 # driver is recreated when browser uses more memory
+BLANK_PAGE_URL = "about:blank"
+
+def createDriver(headless=False):
+    # selenium is loaded by the first driver, not by modules which only pass drivers around
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.add_argument('--ignore-certificate-errors')
+    options.add_argument('--ignore-ssl-errors')
+    if headless:
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--window-size=1920,1080')
+    return webdriver.Chrome(chrome_options=options)
+
+# Memory of driver and browser processes, None without psutil
+# (js heap of blank page which driver shows between jobs says nothing about browser memory)
+def getDriverMemoryMb(wd):
+    if not psutil:
+        return None
+
+    try:
+        process = psutil.Process(wd.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except Exception as ex:
+        print("getDriverMemoryMb: ", ex)
+        return 0
+
+# Keeps headless drivers alive between jobs, so next query doesn't wait for browser startup
+class BrowserPool:
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_jobs_per_driver=DEFAULT_MAX_JOBS_PER_DRIVER, max_memory_mb=DEFAULT_MAX_MEMORY_MB, headless=True, keep_warm=True):
+        self._size = max(1, size)
+        self._max_jobs_per_driver = max_jobs_per_driver
+        if max_memory_mb and not psutil:
+            print("BrowserPool: psutil isn't installed, drivers are recycled by jobs count only")
+            max_memory_mb = None
+        self._max_memory_mb = max_memory_mb
+        self._headless = headless
+        # spawn replacement in background when recycled driver is closed
+        self._keep_warm = keep_warm
+
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._jobs_count = {} # driver -> amount of finished jobs
+        self._drivers_count = 0 # idle + leased + spawning
+        self._closed = False
+
+    # Spawns drivers in background thread (e.g. while user is filling the form)
+    def prewarm(self, count=1):
+        for _ in range(count):
+            with self._condition:
+                if self._closed or self._drivers_count >= self._size:
+                    return
+                self._drivers_count += 1
+            threading.Thread(target=self._spawnIdle, daemon=True).start()
+
+    def lease(self, timeout=None):
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("BrowserPool is closed")
+
+                if self._idle:
+                    return self._idle.popleft()
+
+                if self._drivers_count < self._size:
+                    self._drivers_count += 1
+                    break
+
+                if not self._condition.wait(timeout):
+                    raise TimeoutError("No free driver in BrowserPool")
+
+        # create driver outside of lock, it takes seconds
+        try:
+            wd = createDriver(self._headless)
+        except:
+            with self._condition:
+                self._drivers_count -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._jobs_count[wd] = 0
+        return wd
+
+    # Driver with settings of pool (e.g. headless) which isn't counted in pool size,
+    # for producers which run when all drivers are leased. Caller quits it
+    def createExtraDriver(self):
+        return createDriver(self._headless)
+
+    # reusable = False when job failed and driver state is unknown
+    def release(self, wd, reusable=True):
+        with self._condition:
+            self._jobs_count[wd] = self._jobs_count.get(wd, 0) + 1
+            jobs_count = self._jobs_count[wd]
+            closed = self._closed
+
+        if reusable and not closed and jobs_count < self._max_jobs_per_driver and self._resetDriver(wd):
+            if not self._max_memory_mb or getDriverMemoryMb(wd) < self._max_memory_mb:
+                with self._condition:
+                    self._idle.append(wd)
+                    self._condition.notify()
+                return
+
+        self._quitDriver(wd)
+
+        if self._keep_warm and not closed:
+            self.prewarm()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle_drivers = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+
+        for wd in idle_drivers:
+            self._quitDriver(wd)
+
+    def _spawnIdle(self):
+        try:
+            wd = createDriver(self._headless)
+        except Exception as ex:
+            print("BrowserPool: ", ex)
+            with self._condition:
+                self._drivers_count -= 1
+                self._condition.notify()
+            return
+
+        with self._condition:
+            if not self._closed:
+                self._jobs_count[wd] = 0
+                self._idle.append(wd)
+                self._condition.notify()
+                return
+
+        self._quitDriver(wd)
+
+    # Clears state left by previous job: extra tabs, cookies, scroll position
+    def _resetDriver(self, wd):
+        try:
+            handles = wd.window_handles
+            for handle in handles[1:]:
+                wd.switch_to.window(handle)
+                wd.close()
+            wd.switch_to.window(handles[0])
+            # delete_all_cookies removes cookies of current domain only
+            wd.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            wd.get(BLANK_PAGE_URL)
+            return True
+        except Exception as ex:
+            print("BrowserPool: ", ex)
+            return False
+
+    def _quitDriver(self, wd):
+        try:
+            wd.quit()
+        except Exception as ex:
+            print("BrowserPool: ", ex)
+
+        with self._condition:
+            self._jobs_count.pop(wd, None)
+            self._drivers_count -= 1
+            self._condition.notify()
+
+_browser_pool = None
+_browser_pool_lock = threading.Lock()
+
+def getBrowserPool():
+    global _browser_pool
+    with _browser_pool_lock:
+        if not _browser_pool:
+            _browser_pool = BrowserPool()
+        return _browser_pool
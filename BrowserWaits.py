@@ -0,0 +1,74 @@
+import time
+import threading
+
+from Cancellation import sleep
+
+# Settings
+WAIT_INITIAL_POLL_TIME = 0.05
+WAIT_MAX_POLL_TIME = 0.5
+WAIT_POLL_BACKOFF = 1.5 # poll interval is multiplied by this value after every unsuccessful check
+
+# Observed wait times grouped by wait name
+class WaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, name, wait_time, timed_out):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"count": 0, "timeouts": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["count"] += 1
+            stats["total_time"] += wait_time
+            stats["max_time"] = max(stats["max_time"], wait_time)
+            if timed_out:
+                stats["timeouts"] += 1
+
+    def get(self):
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                result[name] = dict(stats)
+                result[name]["avg_time"] = stats["total_time"] / stats["count"] if stats["count"] else 0.0
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def printReport(self):
+        for name, stats in self.get().items():
+            print(f"Wait '{name}': {stats['count']} waits, avg {stats['avg_time']:.2f}s, max {stats['max_time']:.2f}s, {stats['timeouts']} timeouts")
+
+_wait_stats = WaitStats()
+
+def getWaitStats():
+    return _wait_stats
+
+# Polls condition with growing interval until it returns truthy value, timeout expires or cancel_token is cancelled
+# Returns last value of condition (falsy on timeout)
+def waitForCondition(name, condition, timeout, initial_poll_time=WAIT_INITIAL_POLL_TIME, max_poll_time=WAIT_MAX_POLL_TIME, cancel_token=None):
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    poll_time = initial_poll_time
+    result = None
+
+    while True:
+        try:
+            result = condition()
+        except Exception:
+            # elements can be detached while page updates, just check again
+            result = None
+
+        now = time.monotonic()
+        if result or now >= deadline:
+            break
+
+        if sleep(min(poll_time, deadline - now), cancel_token):
+            break
+        poll_time = min(poll_time * WAIT_POLL_BACKOFF, max_poll_time)
+
+    _wait_stats.add(name, time.monotonic() - start_time, not result)
+    return result
+
+def countElements(wd, selector):
+    return wd.execute_script("return document.querySelectorAll(arguments[0]).length;", selector)
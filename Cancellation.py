@@ -0,0 +1,79 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Raised by interruptible waits and transfers when run was cancelled
+class OperationCancelled(Exception):
+    pass
+
+# Shared by all stages of one run: sleeps wake up and registered callbacks
+# (e.g. abort of in-flight response) are called as soon as token is cancelled
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_callback_id = 0
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as ex:
+                print("CancellationToken: ", ex)
+
+    def isCancelled(self):
+        return self._event.is_set()
+
+    # Returns True if token was cancelled before timeout expired
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    # Callback is called from cancelling thread if token is cancelled inside with block
+    # (immediately if it is already cancelled)
+    @contextmanager
+    def onCancel(self, callback):
+        with self._lock:
+            is_cancelled = self._event.is_set()
+            callback_id = self._next_callback_id
+            self._next_callback_id += 1
+            if not is_cancelled:
+                self._callbacks[callback_id] = callback
+
+        if is_cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.pop(callback_id, None)
+
+# Helpers below accept None for operations which can't be cancelled
+
+def isCancelled(cancel_token):
+    return bool(cancel_token) and cancel_token.isCancelled()
+
+def checkCancelled(cancel_token):
+    if isCancelled(cancel_token):
+        raise OperationCancelled()
+
+# Sleeps for seconds, returns True (without waiting for the rest of time) if token was cancelled
+def sleep(seconds, cancel_token=None):
+    if cancel_token:
+        return cancel_token.wait(seconds)
+    time.sleep(seconds)
+    return False
+
+@contextmanager
+def onCancel(cancel_token, callback):
+    if not cancel_token:
+        yield
+        return
+    with cancel_token.onCancel(callback):
+        yield
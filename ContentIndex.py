@@ -0,0 +1,182 @@
+import io
+import os
+import json
+import threading
+from hashlib import sha1
+
+# Settings
+CONTENT_INDEX_FILE_NAME = ".content_index.jsonl" # sidecar file in save dir, so existing images aren't hashed again
+DEFAULT_MAX_HASH_DISTANCE = 5 # max amount of different bits of perceptual hashes for near duplicate images
+HASH_BITS = 64
+FILE_READ_CHUNK_SIZE = 1024 * 64
+
+def getFileHash(file_path):
+    file_hash = sha1()
+    with open(file_path, 'rb') as file:
+        for data in iter(lambda: file.read(FILE_READ_CHUNK_SIZE), b""):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+# 64 bit difference hash: compares neighbour pixels of 9x8 grayscale thumbnail
+def getPerceptualHash(file_path):
+    from PIL import Image
+
+    with Image.open(file_path) as image:
+        # let jpeg decoder downscale while decoding, full resolution isn't needed
+        image.draft("L", (64, 64))
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def getHashDistance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+# Multi-index hashing: hash is split into max_distance + 1 parts, so near duplicate
+# (at most max_distance different bits) has at least one part equal to the searched hash
+class PerceptualHashIndex:
+    def __init__(self, max_distance=DEFAULT_MAX_HASH_DISTANCE):
+        self.max_distance = max_distance
+        parts_count = max_distance + 1
+        bounds = [(HASH_BITS * i) // parts_count for i in range(parts_count + 1)]
+        self._parts = [(bounds[i], (1 << (bounds[i + 1] - bounds[i])) - 1) for i in range(parts_count)]
+        self._buckets = [{} for _ in self._parts]
+
+    def _getKeys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._parts]
+
+    def add(self, value, item):
+        for buckets, key in zip(self._buckets, self._getKeys(value)):
+            buckets.setdefault(key, []).append((value, item))
+
+    def remove(self, value, item):
+        for buckets, key in zip(self._buckets, self._getKeys(value)):
+            bucket = buckets.get(key)
+            if bucket and (value, item) in bucket:
+                bucket.remove((value, item))
+                if not bucket:
+                    del buckets[key]
+
+    # Returns item of nearest hash within max_distance or None
+    def find(self, value):
+        best_item, best_distance = None, self.max_distance + 1
+        for buckets, key in zip(self._buckets, self._getKeys(value)):
+            for other_value, item in buckets.get(key, ()):
+                distance = getHashDistance(value, other_value)
+                if distance < best_distance:
+                    best_item, best_distance = item, distance
+        return best_item
+
+# Exact (file hash) and near duplicate (perceptual hash) index of images in save dir
+class ContentIndex:
+    def __init__(self, save_dir, max_distance=DEFAULT_MAX_HASH_DISTANCE):
+        self.save_dir = save_dir
+        self._lock = threading.Lock()
+        self._file_hashes = {} # file hash -> relative path
+        self._file_entries = {} # relative path -> (file hash, perceptual hash)
+        self._perceptual_hashes = PerceptualHashIndex(max_distance)
+        self._sidecar_path = os.path.join(save_dir, CONTENT_INDEX_FILE_NAME)
+        self._load()
+
+    def __len__(self):
+        return len(self._file_hashes)
+
+    # Returns relative path of already indexed duplicate, otherwise adds file to index and returns None.
+    # file_hash - sha1 of file if it is already known (e.g. computed while file was written)
+    def addIfUnique(self, file_path, file_hash=None):
+        file_hash = file_hash or getFileHash(file_path)
+        perceptual_hash = self._getPerceptualHashSafe(file_path)
+        relative_path = os.path.relpath(file_path, self.save_dir)
+
+        with self._lock:
+            duplicate = self._file_hashes.get(file_hash)
+            if not duplicate and perceptual_hash is not None:
+                duplicate = self._perceptual_hashes.find(perceptual_hash)
+            if duplicate and duplicate != relative_path:
+                return duplicate
+
+            self._addEntry(relative_path, file_hash, perceptual_hash)
+            self._appendToSidecar(relative_path, file_hash, perceptual_hash)
+            return None
+
+    # Forgets file which was removed from save dir.
+    # Its line stays in sidecar, lines of missing files are dropped when index is loaded
+    def remove(self, file_path):
+        relative_path = os.path.relpath(file_path, self.save_dir)
+        with self._lock:
+            entry = self._file_entries.pop(relative_path, None)
+            if not entry:
+                return
+
+            file_hash, perceptual_hash = entry
+            if self._file_hashes.get(file_hash) == relative_path:
+                del self._file_hashes[file_hash]
+            if perceptual_hash is not None:
+                self._perceptual_hashes.remove(perceptual_hash, relative_path)
+
+    def _addEntry(self, relative_path, file_hash, perceptual_hash):
+        self._file_hashes[file_hash] = relative_path
+        self._file_entries[relative_path] = (file_hash, perceptual_hash)
+        if perceptual_hash is not None:
+            self._perceptual_hashes.add(perceptual_hash, relative_path)
+
+    def _getPerceptualHashSafe(self, file_path):
+        try:
+            return getPerceptualHash(file_path)
+        except Exception as ex:
+            print("ContentIndex: ", ex)
+            return None
+
+    def _appendToSidecar(self, relative_path, file_hash, perceptual_hash):
+        try:
+            with io.open(self._sidecar_path, 'a', encoding='utf-8') as sidecar:
+                sidecar.write(json.dumps({"file": relative_path, "sha1": file_hash, "phash": perceptual_hash}) + "\n")
+        except Exception as ex:
+            print("ContentIndex: ", ex)
+
+    # Loads hashes from sidecar file and hashes images which aren't in it yet
+    def _load(self):
+        entries = {}
+        if os.path.exists(self._sidecar_path):
+            with io.open(self._sidecar_path, 'r', encoding='utf-8') as sidecar:
+                for line in sidecar:
+                    try:
+                        entry = json.loads(line)
+                        entries[entry["file"]] = entry
+                    except ValueError:
+                        continue
+
+        existing_files = set()
+        for directory, _, file_names in os.walk(self.save_dir):
+            for file_name in file_names:
+                if not file_name.startswith("."):
+                    existing_files.add(os.path.relpath(os.path.join(directory, file_name), self.save_dir))
+
+        missing_files = existing_files - set(entries)
+        for relative_path in missing_files:
+            file_path = os.path.join(self.save_dir, relative_path)
+            try:
+                entries[relative_path] = {"file": relative_path, "sha1": getFileHash(file_path), "phash": self._getPerceptualHashSafe(file_path)}
+            except Exception as ex:
+                print("ContentIndex: ", ex)
+
+        for relative_path in existing_files:
+            if relative_path in entries:
+                self._addEntry(relative_path, entries[relative_path]["sha1"], entries[relative_path]["phash"])
+
+        # rewrite sidecar when files were added or removed outside of ImageScrapper
+        if missing_files or len(entries) != len(existing_files):
+            self._saveSidecar([entries[path] for path in existing_files if path in entries])
+
+    def _saveSidecar(self, entries):
+        try:
+            temp_path = self._sidecar_path + ".tmp"
+            with io.open(temp_path, 'w', encoding='utf-8') as sidecar:
+                for entry in entries:
+                    sidecar.write(json.dumps(entry) + "\n")
+            os.replace(temp_path, self._sidecar_path)
+        except Exception as ex:
+            print("ContentIndex: ", ex)
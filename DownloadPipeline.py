@@ -0,0 +1,103 @@
+import threading
+from queue import Queue, Empty, Full
+
+from SearchEngines import normalizeImageUrl
+from SearchEngines import createDownloadResult
+from SearchEngines import OUTCOME_CANCELLED
+
+
+# Settings
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+QUEUE_POLL_TIME = 0.2 # how often blocked producer/workers check if pipeline was stopped
+
+# Browser thread (or several threads of multi engine) produces image candidates into bounded queue,
+# download workers validate them and write to disk
+class DownloadPipeline:
+    # downloaded_images_count - images downloaded before (by resumed run)
+    def __init__(self, downloader, max_images_count, workers_count=DEFAULT_DOWNLOAD_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, 
+                 on_image_downloaded=None, on_candidate_processed=None, downloaded_images_count=0):
+        self._downloader = downloader
+        self._max_images_count = max_images_count
+        self._on_image_downloaded = on_image_downloaded
+        self._on_candidate_processed = on_candidate_processed
+
+        self._queue = Queue(maxsize=queue_size)
+        self._workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, workers_count))]
+        self._lock = threading.Lock()
+        self._seen_urls = set()
+
+        # variable to allow terminate workers
+        self._running = True
+        # set when producer will not put any more candidates
+        self._producer_finished = False
+
+        self.downloaded_images_count = downloaded_images_count
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def terminate(self):
+        self._running = False
+
+    def isDone(self):
+        return not self._running or self.downloaded_images_count >= self._max_images_count
+
+    # Returns False if pipeline is done and candidate was not queued
+    def put(self, candidate):
+        # the same image can be found by several engines with slightly different url
+        url_key = normalizeImageUrl(candidate["url"])
+        with self._lock:
+            if url_key in self._seen_urls:
+                return True
+            self._seen_urls.add(url_key)
+
+        while not self.isDone():
+            try:
+                self._queue.put(candidate, timeout=QUEUE_POLL_TIME)
+                return True
+            except Full:
+                continue
+
+        return False
+
+    # Waits until workers process already queued candidates (or pipeline is done), call after all producers finished.
+    # Terminated pipeline isn't waited for, its workers only abort their current candidates
+    def join(self):
+        self._producer_finished = True
+        for worker in self._workers:
+            while worker.is_alive() and self._running:
+                worker.join(QUEUE_POLL_TIME)
+
+    def _worker(self):
+        while not self.isDone():
+            try:
+                candidate = self._queue.get(timeout=QUEUE_POLL_TIME)
+            except Empty:
+                if self._producer_finished:
+                    break
+                continue
+
+            result = self._downloader.tryDownload(candidate)
+            if self._downloader.isDownloaded(result) and not self._onImageDownloaded(candidate, result):
+                # removed surplus image isn't reported as downloaded (journal, manifest)
+                result = createDownloadResult(OUTCOME_CANCELLED, is_requested=False)
+
+            if self._on_candidate_processed:
+                self._on_candidate_processed(candidate, result)
+
+    # Returns False if image was surplus and removed
+    def _onImageDownloaded(self, candidate, result):
+        with self._lock:
+            if self.downloaded_images_count >= self._max_images_count:
+                # other workers already reached the limit while this image was downloading
+                self._downloader.discard(candidate["url"], result)
+                return False
+
+            self.downloaded_images_count += 1
+
+            # called under lock, so progress is reported in order
+            if self._on_image_downloaded:
+                self._on_image_downloaded(self.downloaded_images_count)
+            return True
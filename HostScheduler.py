@@ -0,0 +1,291 @@
+import time
+import socket
+import random
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from HttpPool import abortResponse
+from Cancellation import OperationCancelled
+from Cancellation import checkCancelled
+from Cancellation import isCancelled
+from Cancellation import onCancel
+from Cancellation import sleep
+
+# Settings
+DEFAULT_HOST_RATE = 10 # requests per second to one host (token bucket refill rate)
+DEFAULT_HOST_BURST = 10 # requests which can be sent to idle host at once
+DEFAULT_INITIAL_HOST_CONCURRENCY = 2 # requests in flight to new host
+DEFAULT_MAX_HOST_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_BASE = 0.5 # seconds before first retry, doubled for every next one
+DEFAULT_BACKOFF_MAX = 10
+DEFAULT_MAX_RETRY_AFTER = 30 # longer Retry-After isn't waited for, request fails
+MAX_HOST_STATES = 4096 # idle hosts are forgotten above this amount
+
+RETRY_STATUS_CODES = (429, 503)
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Results of request to host
+HOST_RESULT_SUCCESS = "success"
+HOST_RESULT_THROTTLED = "throttled" # host is overloaded or limits us: 429, 503, timeout, reset connection
+HOST_RESULT_FAILED = "failed" # other failure which doesn't say anything about host load
+
+HOST_COUNTERS = ["requests", "retries", "throttled"]
+
+# Returns seconds from Retry-After header (delay or http date) or None
+def getRetryAfter(response):
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # http date is rare, its parser isn't loaded until it is needed
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Exception with exceptions it was raised from (requests and urllib3 wrap the original socket error)
+def _getErrorChain(ex):
+    chain = []
+    pending = [ex]
+    while pending:
+        error = pending.pop()
+        if not isinstance(error, BaseException) or any(error is other for other in chain):
+            continue
+        chain.append(error)
+        pending.extend([error.__cause__, error.__context__, getattr(error, "reason", None)] + list(error.args))
+    return chain
+
+# True for timeouts and reset connections, which mean that host is overloaded or limits us, so they are retried.
+# Unknown host, refused connection and other errors won't go away with retry and say nothing about load of host
+def isTransientError(ex):
+    import urllib3
+    import requests
+
+    chain = _getErrorChain(ex)
+    if any(isinstance(error, (socket.gaierror, ConnectionRefusedError)) or type(error).__name__ == "NameResolutionError" for error in chain):
+        return False
+    return any(isinstance(error, (requests.exceptions.Timeout, urllib3.exceptions.TimeoutError, TimeoutError, ConnectionResetError, ConnectionAbortedError))
+        for error in chain)
+
+def getHostResult(response):
+    if response.ok:
+        return HOST_RESULT_SUCCESS
+    if response.status_code in THROTTLE_STATUS_CODES:
+        return HOST_RESULT_THROTTLED
+    return HOST_RESULT_FAILED
+
+class HostState:
+    def __init__(self, burst, concurrency_limit):
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.concurrency_limit = float(concurrency_limit)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.counters = dict.fromkeys(HOST_COUNTERS, 0)
+
+# Admission of requests to every host: token bucket limits request rate,
+# concurrency limit grows by one per window of successes and halves when host throttles (AIMD).
+# Transient failures are retried with jittered exponential backoff or after Retry-After
+class HostScheduler:
+    def __init__(self, rate=DEFAULT_HOST_RATE, burst=DEFAULT_HOST_BURST,
+                 initial_concurrency=DEFAULT_INITIAL_HOST_CONCURRENCY, max_concurrency=DEFAULT_MAX_HOST_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX,
+                 max_retry_after=DEFAULT_MAX_RETRY_AFTER):
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+        self._condition = threading.Condition()
+        self._hosts = {}
+        self._stats = dict.fromkeys(HOST_COUNTERS, 0)
+
+    # Waits until request to host can be sent, raises OperationCancelled if cancel_token is cancelled meanwhile
+    def acquire(self, host, cancel_token=None):
+        with onCancel(cancel_token, self._wakeUp), self._condition:
+            state = self._getState(host)
+            while True:
+                checkCancelled(cancel_token)
+                now = time.monotonic()
+                self._refill(state, now)
+                wait_time = self._getWaitTime(state, now)
+                if wait_time == 0:
+                    state.tokens -= 1
+                    state.in_flight += 1
+                    self._stats["requests"] += 1
+                    state.counters["requests"] += 1
+                    return
+                # None - wait until other request to host is released
+                self._condition.wait(wait_time)
+
+    def release(self, host, result):
+        with self._condition:
+            state = self._getState(host)
+            state.in_flight -= 1
+
+            if result == HOST_RESULT_SUCCESS:
+                state.concurrency_limit = min(self.max_concurrency, state.concurrency_limit + 1 / state.concurrency_limit)
+            elif result == HOST_RESULT_THROTTLED:
+                state.concurrency_limit = max(1.0, state.concurrency_limit / 2)
+                self._stats["throttled"] += 1
+                state.counters["throttled"] += 1
+
+            self._condition.notify_all()
+
+    # Don't send requests to host for seconds (e.g. Retry-After)
+    def block(self, host, seconds):
+        with self._condition:
+            state = self._getState(host)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + seconds)
+
+    # Opens response with request() (e.g. lambda: session.get(url, stream=True)), retries transient failures.
+    # Host slot is held until response is closed at the end of with block.
+    # Cancelled cancel_token aborts waits and reading of response body with OperationCancelled
+    @contextmanager
+    def open(self, url, request, cancel_token=None):
+        host = urlparse(url).hostname or ""
+        response = self._send(host, request, cancel_token)
+
+        result = HOST_RESULT_FAILED
+        try:
+            with onCancel(cancel_token, lambda: abortResponse(response)):
+                yield response
+            result = getHostResult(response)
+        except Exception as ex:
+            # aborted read says nothing about host
+            if isCancelled(cancel_token) and not isinstance(ex, OperationCancelled):
+                raise OperationCancelled() from ex
+            if isTransientError(ex):
+                # body wasn't received in time or connection was reset
+                result = HOST_RESULT_THROTTLED
+            raise
+        finally:
+            response.close()
+            self.release(host, result)
+
+    def getConcurrencyLimit(self, host):
+        with self._condition:
+            state = self._hosts.get(host)
+            return int(state.concurrency_limit) if state else self.initial_concurrency
+
+    # Counters of all requests and of every known host with its current concurrency limit
+    def getStats(self):
+        with self._condition:
+            hosts = {host: dict(state.counters, concurrency_limit=int(state.concurrency_limit), in_flight=state.in_flight)
+                for host, state in self._hosts.items()}
+            return dict(self._stats, hosts=hosts)
+
+    # Returns response with host slot acquired (slot is released by caller)
+    def _send(self, host, request, cancel_token=None):
+        # Metrics reports stats of host scheduler
+        from Metrics import getRunMetrics
+
+        metrics = getRunMetrics()
+        attempt = 0
+
+        while True:
+            with metrics.measure("host_wait"):
+                self.acquire(host, cancel_token)
+
+            try:
+                response = request()
+            except Exception as ex:
+                # unknown host or refused connection fails fast
+                if not isTransientError(ex):
+                    self.release(host, HOST_RESULT_FAILED)
+                    raise
+                self.release(host, HOST_RESULT_THROTTLED)
+                if attempt >= self.max_retries:
+                    raise
+                print(f"HostScheduler: {host} {ex}, retrying")
+                self._backoff(host, self._getBackoffTime(attempt), cancel_token)
+                attempt += 1
+                continue
+            except BaseException:
+                self.release(host, HOST_RESULT_FAILED)
+                raise
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            retry_after = getRetryAfter(response)
+            if retry_after is not None:
+                self.block(host, min(retry_after, self.max_retry_after))
+            delay = retry_after if retry_after is not None else self._getBackoffTime(attempt)
+
+            # give up, caller gets failed response
+            if attempt >= self.max_retries or delay > self.max_retry_after:
+                return response
+
+            response.close()
+            self.release(host, getHostResult(response))
+            print(f"HostScheduler: {host} answered {response.status_code}, retrying in {delay:.1f}s")
+            self._backoff(host, delay, cancel_token)
+            attempt += 1
+
+    def _backoff(self, host, delay, cancel_token=None):
+        from Metrics import getRunMetrics
+
+        with self._condition:
+            self._stats["retries"] += 1
+            self._getState(host).counters["retries"] += 1
+        with getRunMetrics().measure("retry_backoff"):
+            if sleep(delay, cancel_token):
+                raise OperationCancelled()
+
+    def _wakeUp(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    # Full jitter: random time up to exponentially growing limit
+    def _getBackoffTime(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _getState(self, host):
+        state = self._hosts.get(host)
+        if not state:
+            if len(self._hosts) >= MAX_HOST_STATES:
+                self._forgetIdleHosts()
+            state = self._hosts[host] = HostState(self.burst, self.initial_concurrency)
+        return state
+
+    def _forgetIdleHosts(self):
+        now = time.monotonic()
+        for host, state in list(self._hosts.items()):
+            if state.in_flight == 0 and state.blocked_until <= now:
+                del self._hosts[host]
+
+    def _refill(self, state, now):
+        state.tokens = min(self.burst, state.tokens + (now - state.updated_at) * self.rate)
+        state.updated_at = now
+
+    # Returns 0 if request can be sent now, seconds to wait or None to wait for released request
+    def _getWaitTime(self, state, now):
+        if state.blocked_until > now:
+            return state.blocked_until - now
+        if state.in_flight >= int(state.concurrency_limit):
+            return None
+        if state.tokens < 1:
+            return (1 - state.tokens) / self.rate
+        return 0
+
+_host_scheduler = HostScheduler()
+
+def getHostScheduler():
+    return _host_scheduler
+
+def configureHostScheduler(**settings):
+    global _host_scheduler
+    _host_scheduler = HostScheduler(**settings)
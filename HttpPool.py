@@ -0,0 +1,160 @@
+import socket
+import threading
+
+# Settings
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'
+DEFAULT_POOL_SIZE = 4 # max kept-alive connections per host
+MAX_HOSTS = 256 # max amount of hosts with kept-alive connections at the same time
+
+# Hosts which serve most of the results get bigger pools
+HOST_POOL_SIZES = {
+    "encrypted-tbn0.gstatic.com": 16,
+    "upload.wikimedia.org": 8,
+    "i.pinimg.com": 8,
+}
+
+# Shared connection pools for all image requests.
+# Adapters (and their urllib3 pools) are shared, each thread gets own lightweight Session mounting them.
+# requests is imported and adapters are created with the first session
+class HttpPool:
+    def __init__(self, default_pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=HOST_POOL_SIZES, max_hosts=MAX_HOSTS):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._evicted_requests = 0
+        self._evicted_connections = 0
+        self._adapters = None
+        self._generation = 0
+        self.configure(default_pool_size, host_pool_sizes, max_hosts)
+
+    def configure(self, default_pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=HOST_POOL_SIZES, max_hosts=MAX_HOSTS):
+        with self._lock:
+            old_adapters = self._adapters or {}
+            self._pool_sizes = (default_pool_size, dict(host_pool_sizes or {}), max_hosts)
+            self._adapters = None
+
+            # sessions of all threads will be recreated with new adapters
+            self._generation += 1
+
+        for adapter in old_adapters.values():
+            self._disposeAdapter(adapter)
+
+    def getSession(self):
+        session = getattr(self._local, "session", None)
+        if session and self._local.generation == self._generation:
+            return session
+
+        import requests
+        with self._lock:
+            if self._adapters is None:
+                self._adapters = self._createAdapters()
+
+            session = requests.Session()
+            session.headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+            session.verify = False
+
+            for host, adapter in self._adapters.items():
+                if host:
+                    session.mount("http://" + host + "/", adapter)
+                    session.mount("https://" + host + "/", adapter)
+                else:
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+
+            self._local.session = session
+            self._local.generation = self._generation
+
+        return session
+
+    # hits - requests sent over already opened connection, misses - requests which opened new connection
+    def getStats(self):
+        with self._lock:
+            requests_count = self._evicted_requests
+            connections_count = self._evicted_connections
+
+            for adapter in (self._adapters or {}).values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool:
+                        requests_count += pool.num_requests
+                        connections_count += pool.num_connections
+
+        return {
+            "requests": requests_count,
+            "hits": max(0, requests_count - connections_count),
+            "misses": connections_count,
+        }
+
+    def close(self):
+        with self._lock:
+            adapters = list((self._adapters or {}).values())
+        for adapter in adapters:
+            self._disposeAdapter(adapter)
+
+    def _createAdapters(self):
+        import urllib3
+        # sessions don't verify certificates of image hosts, so warning would be printed for every request
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        default_pool_size, host_pool_sizes, max_hosts = self._pool_sizes
+        adapters = {"": self._createAdapter(max_hosts, default_pool_size)}
+        for host, pool_size in host_pool_sizes.items():
+            adapters[host] = self._createAdapter(1, pool_size)
+        return adapters
+
+    def _createAdapter(self, pool_connections, pool_maxsize):
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        pools = adapter.poolmanager.pools
+        dispose_func = pools.dispose_func
+
+        # keep stats of pools evicted from the manager
+        def onPoolDisposed(pool):
+            self._evicted_requests += pool.num_requests
+            self._evicted_connections += pool.num_connections
+            if dispose_func:
+                dispose_func(pool)
+
+        pools.dispose_func = onPoolDisposed
+        return adapter
+
+    def _disposeAdapter(self, adapter):
+        try:
+            adapter.close()
+        except Exception as ex:
+            print("HttpPool: ", ex)
+
+_http_pool = HttpPool()
+
+def getSession():
+    return _http_pool.getSession()
+
+def configureHttpPool(default_pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=HOST_POOL_SIZES, max_hosts=MAX_HOSTS):
+    _http_pool.configure(default_pool_size, host_pool_sizes, max_hosts)
+
+def getHttpPoolStats():
+    return _http_pool.getStats()
+
+# Parses "host=size" command line value, returns (host, size)
+def parseHostPoolSize(text):
+    host, _, size = text.partition("=")
+    if not host or int(size) <= 0:
+        raise ValueError("pool size of host must be positive: " + text)
+    return host, int(size)
+
+# Pool sizes of hosts with defaults overridden by (host, size) pairs
+def getHostPoolSizes(overrides):
+    host_pool_sizes = dict(HOST_POOL_SIZES)
+    host_pool_sizes.update(overrides or [])
+    return host_pool_sizes
+
+# Shuts down socket of streamed response, so thread which reads it fails immediately
+# (closing socket from other thread doesn't wake up blocked read)
+def abortResponse(response):
+    try:
+        connection = response.raw.connection
+        if connection and connection.sock:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+    except Exception as ex:
+        print("abortResponse: ", ex)
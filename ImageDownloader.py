@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+
+from SearchEngines import downloadImageCandidate
+from SearchEngines import createDownloadResult
+from SearchEngines import isContentTypeValid
+from SearchEngines import getResolutionRejectReason
+from SearchEngines import OUTCOME_DOWNLOADED
+from SearchEngines import OUTCOME_INVALID_CONTENT_TYPE
+from SearchEngines import OUTCOME_UNKNOWN_RESOLUTION
+from SearchEngines import OUTCOME_DUPLICATE
+from SearchEngines import OUTCOME_TOO_BIG
+from SearchEngines import OUTCOME_ERROR
+from SearchEngines import OUTCOME_TIMEOUT
+from SearchEngines import OUTCOME_CANCELLED
+from SearchEngines import IMAGE_MAX_BYTES
+from SearchEngines import IMAGE_FSYNC
+
+from Metrics import getRunMetrics
+from HostScheduler import isTransientError
+
+from Cancellation import OperationCancelled
+from Cancellation import isCancelled
+
+# Settings
+ERROR_RETRY_INTERVAL = 24 * 60 * 60 # seconds before url which failed to download will be requested again
+TIMEOUT_RETRY_INTERVAL = 60 * 60 # the same for url which timed out or whose connection was reset (host was overloaded)
+UNLIMITED_RESOLUTION = (sys.maxsize, sys.maxsize)
+
+# Downloads image candidates of one job (criteria and save dir),
+# urls already known by url index are decided without any request,
+# downloaded images which duplicate content of already saved ones are removed.
+# With transformer (ImageTransform.ImageTransformer) downloaded images are post-processed,
+# images bigger than max resolution are downscaled instead of rejected if transform options allow it.
+# Candidates interrupted by cancelled cancel_token get OUTCOME_CANCELLED and aren't indexed.
+# Downloaded image which won't be reported (surplus of the run) is removed with discard.
+# dir_levels > 0 saves images to hash prefix subdirectories of save dir (see SearchEngines.getImageDir)
+class ImageDownloader:
+    def __init__(self, min_resolution, max_resolution, valid_contentTypes, save_dir, url_index=None, content_index=None, max_bytes=IMAGE_MAX_BYTES, fsync=IMAGE_FSYNC,
+                 transformer=None, cancel_token=None, dir_levels=0):
+        self.min_resolution = min_resolution
+        self.max_resolution = max_resolution
+        # max resolution of images which are downloaded
+        self.accepted_max_resolution = UNLIMITED_RESOLUTION if transformer and transformer.options["downscale"] else max_resolution
+        self.valid_contentTypes = valid_contentTypes
+        self.save_dir = save_dir
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dir_levels = dir_levels
+        self._url_index = url_index
+        self._content_index = content_index
+        self._transformer = transformer
+        self._cancel_token = cancel_token
+
+    # Returns download result (see SearchEngines.createDownloadResult)
+    def tryDownload(self, candidate):
+        img_url = candidate["url"]
+        # result of download before transform, url index keeps what the url itself serves
+        source_result = None
+
+        try:
+            result = self._getIndexedResult(img_url)
+            if result:
+                return result
+
+            with getRunMetrics().measure("download"):
+                result = downloadImageCandidate(img_url, candidate["resolution"], self.min_resolution, self.accepted_max_resolution, self.valid_contentTypes, self.save_dir,
+                    self.max_bytes, self.fsync, self._cancel_token, self.dir_levels)
+            source_result = result
+
+            if self.isDownloaded(result) and self._transformer and self._transformer.isNeeded(result["resolution"], result["content_type"], self.max_resolution):
+                with getRunMetrics().measure("transform"):
+                    result = self._transform(result)
+
+            if self.isDownloaded(result) and self._content_index is not None:
+                with getRunMetrics().measure("content_dedup"):
+                    result = self._dropContentDuplicate(result)
+
+            if self.isDownloaded(result) and isCancelled(self._cancel_token):
+                # cancelled run can be closed before this image is reported, resumed run downloads it again
+                self.discard(img_url, result)
+                result = createDownloadResult(OUTCOME_CANCELLED, is_requested=False)
+        except OperationCancelled:
+            result = createDownloadResult(OUTCOME_CANCELLED, is_requested=False)
+        except Exception as ex:
+            if isCancelled(self._cancel_token):
+                result = createDownloadResult(OUTCOME_CANCELLED, is_requested=False)
+            elif isTransientError(ex):
+                # requests raises read timeout of streamed body as ConnectionError
+                print("tryDownload: ", ex)
+                result = createDownloadResult(OUTCOME_TIMEOUT)
+            else:
+                print("tryDownload: ", ex)
+                result = createDownloadResult(OUTCOME_ERROR)
+
+        if result["is_requested"]:
+            self._addToIndex(img_url, result, source_result)
+
+        return result
+
+    def isDownloaded(self, result):
+        return result["outcome"] == OUTCOME_DOWNLOADED
+
+    # Removes downloaded image with its entries in content and url index, so the url is downloaded again by the next run
+    def discard(self, img_url, result):
+        try:
+            os.remove(result["file_path"])
+        except Exception as ex:
+            print("discard: ", ex)
+
+        if self._content_index is not None:
+            self._content_index.remove(result["file_path"])
+        if self._url_index:
+            try:
+                self._url_index.remove(img_url)
+            except Exception as ex:
+                print("discard: ", ex)
+
+    # Returns result for url which doesn't need any request or None
+    def _getIndexedResult(self, img_url):
+        if not self._url_index:
+            return None
+
+        record = self._url_index.get(img_url)
+        if not record:
+            return None
+
+        # content type and true resolution are checked against criteria of current job
+        if record["content_type"] and not isContentTypeValid(record["content_type"], self.valid_contentTypes):
+            return createDownloadResult(OUTCOME_INVALID_CONTENT_TYPE, record["content_type"], record["resolution"], is_requested=False)
+
+        if record["resolution"]:
+            reject_reason = getResolutionRejectReason(record["resolution"], self.min_resolution, self.accepted_max_resolution)
+            if reject_reason:
+                return createDownloadResult(reject_reason, record["content_type"], record["resolution"], is_requested=False)
+
+        if record["outcome"] in (OUTCOME_DOWNLOADED, OUTCOME_DUPLICATE) and self._isFileInSaveDir(record["file_path"]):
+            return createDownloadResult(OUTCOME_DUPLICATE, record["content_type"], record["resolution"], record["file_path"], is_requested=False)
+
+        retry_interval = TIMEOUT_RETRY_INTERVAL if record["outcome"] == OUTCOME_TIMEOUT else ERROR_RETRY_INTERVAL
+        if record["outcome"] in (OUTCOME_ERROR, OUTCOME_TIMEOUT, OUTCOME_UNKNOWN_RESOLUTION) and time.time() - record["updated_at"] < retry_interval:
+            return createDownloadResult(record["outcome"], record["content_type"], record["resolution"], is_requested=False)
+
+        return None
+
+    # Replaces downloaded image with transformed one, oversized image which can't be downscaled is removed
+    def _transform(self, result):
+        try:
+            transformed = self._transformer.transform(result["file_path"], self.max_resolution)
+        except Exception as ex:
+            print("_transform: ", ex)
+            transformed = None
+
+        if transformed:
+            return createDownloadResult(OUTCOME_DOWNLOADED, transformed["content_type"], transformed["resolution"], transformed["file_path"],
+                file_size=transformed["file_size"], bytes_per_second=result["bytes_per_second"])
+
+        if getResolutionRejectReason(result["resolution"], self.min_resolution, self.max_resolution) == OUTCOME_TOO_BIG:
+            os.remove(result["file_path"])
+            return createDownloadResult(OUTCOME_TOO_BIG, result["content_type"], result["resolution"])
+
+        # image fits criteria, it is kept as downloaded
+        return result
+
+    # Removes downloaded image if the same (or nearly the same) image is already saved
+    def _dropContentDuplicate(self, result):
+        duplicate = self._content_index.addIfUnique(result["file_path"], result["content_hash"])
+        if not duplicate:
+            return result
+
+        os.remove(result["file_path"])
+        print("DUPLICATE: " + result["file_path"] + " == " + duplicate)
+        return createDownloadResult(OUTCOME_DUPLICATE, result["content_type"], result["resolution"], os.path.join(self.save_dir, duplicate))
+
+    # File can be in subdirectory of save dir (sharded layout of this or previous run)
+    def _isFileInSaveDir(self, file_path):
+        if not file_path or not os.path.exists(file_path):
+            return False
+        save_dir = os.path.abspath(self.save_dir)
+        try:
+            return os.path.commonpath([os.path.abspath(file_path), save_dir]) == save_dir
+        except ValueError:
+            # paths on different drives
+            return False
+
+    # Outcome and file are the final ones, content type and resolution are those of the source
+    # (transformed image has other ones, they would reject the url for other jobs)
+    def _addToIndex(self, img_url, result, source_result=None):
+        if not self._url_index:
+            return
+
+        source_result = source_result or result
+        try:
+            file_path = os.path.abspath(result["file_path"]) if result["file_path"] else None
+            self._url_index.add(img_url, result["outcome"], source_result["content_type"], source_result["resolution"], file_path)
+        except Exception as ex:
+            print("_addToIndex: ", ex)
@@ -0,0 +1,74 @@
+import io
+import os
+import json
+import time
+import threading
+
+# Settings
+MANIFEST_FILE_NAME = ".manifest.jsonl" # sidecar file in save dir, dot prefix hides it from content index
+MANIFEST_BATCH_SIZE = 256 # records written to file at once
+MANIFEST_FLUSH_INTERVAL = 5 # max seconds record waits in memory (checked when next record is added)
+
+def createManifestRecord(file_path, save_dir, url, search_query, search_engine, resolution, file_size, content_type, content_hash):
+    return {
+        # relative to save dir with "/" separators, so manifest stays valid when folder is moved
+        "file": os.path.relpath(file_path, save_dir).replace(os.sep, "/"),
+        "url": url,
+        "query": search_query,
+        "engine": search_engine,
+        "width": resolution[0] if resolution else None,
+        "height": resolution[1] if resolution else None,
+        "bytes": file_size,
+        "content_type": content_type,
+        "sha1": content_hash,
+        "time": time.time()
+    }
+
+# Yields records of manifest file, unfinished last line (crash while writing) is skipped
+def readManifest(path):
+    with io.open(path, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+# Append-only list of images saved to save dir, so consumers read one file instead of walking the tree.
+# Records are buffered and appended in batches, records of the last batch are lost if process crashes
+class ImageManifest:
+    def __init__(self, save_dir, batch_size=MANIFEST_BATCH_SIZE, flush_interval=MANIFEST_FLUSH_INTERVAL):
+        self.path = os.path.join(save_dir, MANIFEST_FILE_NAME)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._records = []
+        self._last_flush_time = time.monotonic()
+        self._closed = False
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            # late record of closed manifest (e.g. download worker finished after run) is written immediately
+            if self._closed or len(self._records) >= self._batch_size or time.monotonic() - self._last_flush_time >= self._flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._flush()
+
+    def _flush(self):
+        self._last_flush_time = time.monotonic()
+        if not self._records:
+            return
+
+        try:
+            with io.open(self.path, 'a', encoding='utf-8') as manifest:
+                manifest.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self._records))
+            self._records = []
+        except Exception as ex:
+            print("ImageManifest: ", ex)
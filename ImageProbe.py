@@ -0,0 +1,187 @@
+import struct
+import threading
+from collections import OrderedDict
+
+# Settings
+PROBE_CACHE_SIZE = 10000 # urls with known resolution kept in memory
+FORMAT_DETECT_BYTES = 32 # bytes needed to recognise format of image
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+AVIF_BRANDS = (b"avif", b"avis")
+
+# Returns "jpeg", "png", "gif", "webp", "avif" or None if format isn't supported by native parser
+def getImageFormat(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:8] == b"ftyp":
+        box_size = struct.unpack(">I", data[:4])[0]
+        brands = bytes(data[8:min(box_size, len(data))])
+        if any(brands[i:i + 4] in AVIF_BRANDS for i in range(0, len(brands), 4)):
+            return "avif"
+    return None
+
+# Returns (width, height) read from header of image or None when header isn't complete yet
+def parseImageSize(data, image_format):
+    try:
+        return _PARSERS[image_format](data)
+    except struct.error:
+        return None
+
+def _parsePng(data):
+    # IHDR is always the first chunk
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", data[16:24])
+
+def _parseGif(data):
+    if len(data) < 10:
+        return None
+    return struct.unpack("<HH", data[6:10])
+
+def _parseJpeg(data):
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        # fill bytes before marker
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            if position + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[position + 5:position + 9])
+            return width, height
+        # skip segment (EXIF, ICC profile, tables ...)
+        position += 2 + struct.unpack(">H", data[position + 2:position + 4])[0]
+    return None
+
+def _parseWebp(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        if len(data) < 30 or data[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if len(data) < 25 or data[20] != 0x2F:
+            return None
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        if len(data) < 30:
+            return None
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+def _parseAvif(data):
+    # all properties are stored before image data, when mdat starts all of them were read
+    properties_end = data.find(b"mdat")
+    if properties_end < 0:
+        return None
+
+    # image spatial extents property, grid images also have smaller ispe of tiles
+    sizes = []
+    position = data.find(b"ispe", 0, properties_end)
+    while position >= 0:
+        sizes.append(struct.unpack(">II", data[position + 8:position + 16]))
+        position = data.find(b"ispe", position + 4, properties_end)
+
+    if not sizes:
+        return None
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+_PARSERS = {
+    "jpeg": _parseJpeg,
+    "png": _parsePng,
+    "gif": _parseGif,
+    "webp": _parseWebp,
+    "avif": _parseAvif,
+}
+
+# Reads resolution from first bytes of image fed chunk by chunk,
+# formats without native parser (bmp, tiff ...) are passed to PIL parser
+class ImageSizeReader:
+    def __init__(self):
+        self.size = None
+        self.read_bytes = 0
+        self._header = bytearray()
+        self._format = None
+        self._parser = None
+
+    # Returns (width, height) when resolution is found, otherwise None
+    def feed(self, data):
+        if self.size:
+            return self.size
+        self.read_bytes += len(data)
+
+        if self._parser:
+            self._parser.feed(data)
+            self.size = self._parser.image.size if self._parser.image else None
+            return self.size
+
+        self._header += data
+        if not self._format:
+            self._format = getImageFormat(self._header)
+            if not self._format:
+                if len(self._header) >= FORMAT_DETECT_BYTES:
+                    self._startPilParser()
+                return self.size
+
+        self.size = parseImageSize(self._header, self._format)
+        return self.size
+
+    # PIL is loaded only for formats without own header parser
+    def _startPilParser(self):
+        from PIL import ImageFile
+
+        self._parser = ImageFile.Parser()
+        try:
+            self._parser.feed(bytes(self._header))
+            self.size = self._parser.image.size if self._parser.image else None
+        finally:
+            self._header = None
+
+# Url -> resolution (None for urls without readable resolution), least recently used urls are dropped
+class ProbeCache:
+    def __init__(self, size=PROBE_CACHE_SIZE):
+        self._size = size
+        self._lock = threading.Lock()
+        self._resolutions = OrderedDict()
+
+    # Returns (True, resolution) for cached url, otherwise (False, None)
+    def get(self, url):
+        with self._lock:
+            if url not in self._resolutions:
+                return False, None
+            self._resolutions.move_to_end(url)
+            return True, self._resolutions[url]
+
+    def put(self, url, resolution):
+        with self._lock:
+            self._resolutions[url] = resolution
+            self._resolutions.move_to_end(url)
+            while len(self._resolutions) > self._size:
+                self._resolutions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._resolutions.clear()
+
+_probe_cache = ProbeCache()
+
+def getProbeCache():
+    return _probe_cache
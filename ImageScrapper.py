@@ -1,30 +1,294 @@
-import time
 from pathlib import Path
-from selenium import webdriver
-import urllib3
 
 from SearchEngines import SEARCH_ENGINES
-from SearchEngines import isResolutionValid
-from SearchEngines import processImageGoogle
-from SearchEngines import processImageDuckDuckGo
+from SearchEngines import findImageCandidatesGoogle
+from SearchEngines import findImageCandidatesDuckDuckGo
+from SearchEngines import findImageCandidatesDuckDuckGoHttp
+from SearchEngines import extractImageCandidatesGoogle
+from SearchEngines import isHttpSearchEngine
+from SearchEngines import isMultiSearchEngine
+from SearchEngines import getUnprocessedSelector
+from SearchEngines import markThumbnailsProcessed
+from SearchEngines import formatSearchUrl
+from SearchEngines import IMAGE_MAX_BYTES
+from SearchEngines import IMAGE_FSYNC
+from SearchEngines import OUTCOME_CANCELLED
+from SearchEngines import OUTCOME_DOWNLOADED
+
+from HttpPool import getSession
+
+from DownloadPipeline import DownloadPipeline
+from DownloadPipeline import DEFAULT_QUEUE_SIZE
+
+from ImageDownloader import ImageDownloader
+
+from ContentIndex import ContentIndex
+from ContentIndex import getFileHash
+
+from ImageManifest import ImageManifest
+from ImageManifest import createManifestRecord
+
+from ImageTransform import ImageTransformer
+from ImageTransform import isTransformEnabled
+
+from RunJournal import RunJournal
+
+from UrlIndex import UrlIndex
+from UrlIndex import DEFAULT_URL_INDEX_PATH
+
+from BrowserPool import createDriver
+
+from BrowserWaits import waitForCondition
+from BrowserWaits import countElements
+from BrowserWaits import getWaitStats
+
+from Metrics import getRunMetrics
+from Metrics import MetricsPublisher
+
+from ProgressBus import getProgressState
+
+from QueryShards import createShard
+from QueryShards import planQueryShards
+from QueryShards import runQueryShards
+
+from Cancellation import CancellationToken
+from Cancellation import OperationCancelled
 
 from pubsub import pub
 
-SLEEP_TIME_AFTER_SCROLL = 2
+SCROLL_WAIT_TIMEOUT = 5 # max seconds to wait for new thumbnails after scroll
+MULTI_DRIVER_LEASE_TIMEOUT = 0 # engines of multi engine (and shards) don't wait for busy pool, they start own driver
+MAX_EMPTY_SCROLLS = 3 # results are exhausted when this amount of scrolls in a row brings no new thumbnails
+
+SE_FIND_CANDIDATES = {
+    "Google": findImageCandidatesGoogle,
+    "DuckDuckGo": findImageCandidatesDuckDuckGo
+}
+
+# engines which can resolve all new thumbnails with one script call (without clicking)
+SE_EXTRACT_CANDIDATES = {
+    "Google": extractImageCandidatesGoogle
+}
 
-SE_PROCESS_IMAGE = {
-    "Google": processImageGoogle,
-    "DuckDuckGo": processImageDuckDuckGo
+# engines which don't need browser, function yields lists of candidates page by page
+SE_FIND_CANDIDATES_HTTP = {
+    "DuckDuckGo HTTP": findImageCandidatesDuckDuckGoHttp
 }
 
+# Loads libraries and starts services the first run needs (http pool, image decoder, browser of browser_pool),
+# so it doesn't wait for them. Called from background thread, e.g. after window appeared
+def warmUpBackend(browser_pool=None):
+    getSession()
+    import PIL.Image
+    if browser_pool:
+        browser_pool.prewarm()
+
 class ImageScrapper:
-    def __init__(self):        
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        # variable to allow terminate this thread
-        self._running = True
+    # download_workers = 0 - browser thread downloads images itself,
+    # download_workers > 0 - browser thread only collects candidates for pool of download workers
+    # bulk_extract - resolve new thumbnails with one script call per page, click only unresolved ones
+    # browser_pool - BrowserPool to lease already started driver from, otherwise new driver is created for every run
+    # url_index_path - sqlite file with urls seen in previous runs (None to disable)
+    # content_dedup - drop downloaded images which are exact or near duplicates of images in save dir
+    # resume - write run journal to save dir and continue unfinished run of the same job from it
+    # max_image_bytes - abort download of bigger images (None - no limit)
+    # fsync - flush every image to disk before it gets its final name
+    # windowed_scroll - mark processed thumbnails in page and query only unmarked ones, so cost of scroll doesn't grow with results
+    # shard_workers - split query into sub-queries (engine filters, suffix terms, see QueryShards) run by this amount of threads,
+    # for targets above result cap of one query (0 - single query)
+    # dir_levels - save images to subdirectories named by prefixes of url hash (0 - all images directly in save dir), for folders with 100k+ images
+    # manifest - append record of every saved image (url, query, engine, resolution, size, hash) to manifest file in save dir
+    def __init__(self, download_workers=0, queue_size=DEFAULT_QUEUE_SIZE, bulk_extract=True, browser_pool=None, url_index_path=DEFAULT_URL_INDEX_PATH, content_dedup=True, resume=True,
+                 max_image_bytes=IMAGE_MAX_BYTES, fsync=IMAGE_FSYNC, windowed_scroll=True, shard_workers=0, dir_levels=0, manifest=True):        
+        # cancels all stages of this scrapper: waits, requests and download workers
+        self._cancel_token = CancellationToken()
+        self._download_workers = download_workers
+        self._queue_size = queue_size
+        self._bulk_extract = bulk_extract
+        self._browser_pool = browser_pool
+        self._url_index_path = url_index_path
+        self._content_dedup = content_dedup
+        self._resume = resume
+        self._max_image_bytes = max_image_bytes
+        self._fsync = fsync
+        self._windowed_scroll = windowed_scroll
+        self._shard_workers = shard_workers
+        self._dir_levels = dir_levels
+        self._use_manifest = manifest
+        self._pipeline = None
+        self._downloader = None
+        self._journal = None
+        self._manifest = None
+        self._search_query = None
+        self._leased_drivers = set()
+        self._max_images_count = 0
+        self._downloaded_images_count = 0
 
     def terminate(self):
-        self._running = False
+        self._cancel_token.cancel()
+        if self._pipeline:
+            self._pipeline.terminate()
+
+    # Progress of current run (see ProgressBus.getProgressState), can be called from any thread
+    def getProgressState(self):
+        return getProgressState(getRunMetrics().getCounters(), self._getDownloadedImagesCount(), self._max_images_count)
+
+    def _onImageDownloaded(self, downloaded_images_count):
+        pub.sendMessage('downloadProgressChanged', progress=(downloaded_images_count * 100) // self._max_images_count)
+
+    def _onMetricsChanged(self, metrics):
+        pub.sendMessage('downloadMetricsChanged', metrics=metrics)
+
+    def _onCandidateProcessed(self, candidate, result):
+        getRunMetrics().addOutcome(result["outcome"], result.get("file_size"))
+        # cancelled candidate stays pending, resumed run processes it again
+        if self._journal and result["outcome"] != OUTCOME_CANCELLED:
+            self._journal.addProcessed(candidate["url"], result["outcome"])
+        if self._manifest and result["outcome"] == OUTCOME_DOWNLOADED:
+            self._addToManifest(candidate, result)
+
+    def _addToManifest(self, candidate, result):
+        try:
+            # transformed image isn't hashed while it is written
+            content_hash = result["content_hash"] or getFileHash(result["file_path"])
+            self._manifest.add(createManifestRecord(result["file_path"], self._downloader.save_dir, candidate["url"], self._search_query, candidate["search_engine"],
+                result["resolution"], result["file_size"], result["content_type"], content_hash))
+        except Exception as ex:
+            print("_addToManifest: ", ex)
+
+    def _createPipeline(self, workers_count):
+        if workers_count <= 0:
+            return None
+
+        pipeline = DownloadPipeline(self._downloader, self._max_images_count,
+            workers_count=workers_count, 
+            queue_size=self._queue_size,
+            on_image_downloaded=self._onImageDownloaded,
+            on_candidate_processed=self._onCandidateProcessed,
+            downloaded_images_count=self._downloaded_images_count)
+        pipeline.start()
+        return pipeline
+
+    def _produceCandidates(self, wd, search_engine):
+        try:
+            with getRunMetrics().measure("preview"):
+                candidates = SE_FIND_CANDIDATES[search_engine](wd, search_engine, self._cancel_token)
+            for candidate in candidates:
+                if not self._queueCandidate(candidate):
+                    break
+        except Exception as ex:
+            print("_produceCandidates: ", ex)
+
+    # Records harvested candidate before it is downloaded, so interrupted candidate stays pending for resumed run.
+    # Returns False if candidate was already processed
+    def _journalCandidate(self, candidate):
+        if not self._journal:
+            return True
+        if self._journal.isProcessed(candidate["url"]):
+            return False
+        self._journal.addCandidate(candidate)
+        return True
+
+    # Passes candidate to download workers, returns False if pipeline is done
+    def _queueCandidate(self, candidate):
+        if not self._journalCandidate(candidate):
+            return True
+        return self._pipeline.put(candidate)
+
+    # Returns True if image was downloaded (always False when candidate was passed to download workers)
+    def _processCandidate(self, candidate):
+        if self._pipeline:
+            self._queueCandidate(candidate)
+            return False
+
+        if not self._journalCandidate(candidate):
+            return False
+
+        result = self._downloader.tryDownload(candidate)
+        self._onCandidateProcessed(candidate, result)
+        if not self._downloader.isDownloaded(result):
+            return False
+
+        self._downloaded_images_count += 1
+        self._onImageDownloaded(self._downloaded_images_count)
+        return True
+
+    # Returns True if one of candidates from opened preview was downloaded
+    def _downloadFirstCandidate(self, wd, search_engine):
+        try:
+            with getRunMetrics().measure("preview"):
+                candidates = SE_FIND_CANDIDATES[search_engine](wd, search_engine, self._cancel_token)
+            for candidate in candidates:
+                if self._processCandidate(candidate):
+                    return True
+        except Exception as ex:
+            print("_downloadFirstCandidate: ", ex)
+
+        return False
+
+    # Candidates harvested but not processed by interrupted run of the same job
+    def _processPendingCandidates(self):
+        if not self._journal:
+            return
+
+        for candidate in self._journal.getPendingCandidates():
+            if not self._isRunning():
+                break
+            self._processCandidate(candidate)
+
+    # Returns list aligned with new thumbnails, None for thumbnails which should be clicked
+    def _extractCandidates(self, wd, search_engine, results_start, thumbnail_selector):
+        if not self._bulk_extract or search_engine not in SE_EXTRACT_CANDIDATES:
+            return []
+
+        try:
+            with getRunMetrics().measure("extract"):
+                return SE_EXTRACT_CANDIDATES[search_engine](wd, search_engine, results_start, thumbnail_selector)
+        except Exception as ex:
+            print("_extractCandidates: ", ex)
+            return []
+
+    def _getDownloadedImagesCount(self):
+        if self._pipeline:
+            return self._pipeline.downloaded_images_count
+        return self._downloaded_images_count
+
+    # False if thread was terminated or max_images_count was reached
+    def _isRunning(self):
+        return not self._cancel_token.isCancelled() and self._getDownloadedImagesCount() < self._max_images_count
+
+    def _setResultsStart(self, results_start):
+        if self._journal:
+            self._journal.setResultsStart(results_start)
+
+    def _openDriver(self, lease_timeout=None):
+        if self._browser_pool:
+            try:
+                wd = self._browser_pool.lease(lease_timeout)
+                self._leased_drivers.add(wd)
+                return wd
+            except TimeoutError:
+                # all drivers of pool are used (e.g. by other engines or shards of the same run)
+                return self._browser_pool.createExtraDriver()
+        return createDriver()
+
+    def _closeDriver(self, wd, reusable=True):
+        if wd in self._leased_drivers:
+            self._leased_drivers.discard(wd)
+            self._browser_pool.release(wd, reusable)
+            return
+
+        # quit (not close) also stops chromedriver process
+        try:
+            wd.quit()
+        except Exception as ex:
+            print("_closeDriver: ", ex)
+
+    def _markThumbnailsProcessed(self, wd, thumbnails):
+        try:
+            markThumbnailsProcessed(wd, thumbnails)
+        except Exception as ex:
+            print("_markThumbnailsProcessed: ", ex)
 
     def _tryLoadMoreImages(self, wd, search_engine):
         try:
@@ -35,67 +299,240 @@ class ImageScrapper:
         except Exception as ex:
             print("_tryLoadMoreImages: ", ex)
 
-    def _findImagesAndDownload(self, search_query, search_engine, max_images_count, min_resolution, max_resolution, valid_contentTypes, save_dir):
-        def scroll_to_end(wd):
-            wd.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(SLEEP_TIME_AFTER_SCROLL)    
+    # multi - engine runs together with other engines (or shards), so it doesn't wait for driver from pool
+    # and position in its results isn't written to journal (journal keeps one position)
+    # search_filter - one of engine filters (None - default filter)
+    def _findImagesAndDownload(self, search_query, search_engine, multi=False, search_filter=None):
+        # create chrome driver (or take already started one from pool)
+        wd = self._openDriver(MULTI_DRIVER_LEASE_TIMEOUT if multi else None)
+        reusable = False
+        try:
+            self._scrollAndDownload(wd, search_query, search_engine, multi, search_filter)
+            reusable = True
+        finally:
+            # driver is closed even if page failed or run was cancelled, pool doesn't reuse driver in unknown state
+            self._closeDriver(wd, reusable)
 
-        # build the google query
-        search_url = SEARCH_ENGINES[search_engine]["search_url"]
+    def _scrollAndDownload(self, wd, search_query, search_engine, multi, search_filter):
+        # windowed scrolling selects only thumbnails which weren't marked as processed
+        thumbnail_selector = SEARCH_ENGINES[search_engine]["selectors"]["thumbnail"]
+        if self._windowed_scroll:
+            thumbnail_selector = getUnprocessedSelector(thumbnail_selector)
 
-        # create chrome driver
-        options = webdriver.ChromeOptions()
-        options.add_argument('--ignore-certificate-errors')
-        options.add_argument('--ignore-ssl-errors')
-        wd = webdriver.Chrome(chrome_options=options)
+        def scroll_to_end(wd, thumbnails_count):
+            with getRunMetrics().measure("scroll"):
+                wd.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                # wait until new thumbnails appear
+                waitForCondition("scroll", 
+                    lambda: countElements(wd, thumbnail_selector) > thumbnails_count, 
+                    SCROLL_WAIT_TIMEOUT, cancel_token=self._cancel_token)
 
         # load the page
-        wd.get(search_url.format(q=search_query))
+        with getRunMetrics().measure("page_load"):
+            wd.get(formatSearchUrl(search_engine, "search_url", search_filter, q=search_query))
+
+        # resumed run skips thumbnails processed before (they are only scrolled, not clicked)
+        results_start = self._journal.results_start if self._journal and not multi else 0
+        # in windowed scrolling thumbnails processed before are marked without processing
+        skip_count = results_start if self._windowed_scroll else 0
+        empty_scrolls_count = 0
 
-        results_start = 0
-        downloaded_images_count = 0
+        while self._isRunning():
+            # index of first new thumbnail among selected ones (windowed scrolling selects only new)
+            window_start = 0 if self._windowed_scroll else results_start
+            scroll_to_end(wd, window_start)
 
-        while self._running and downloaded_images_count < max_images_count:
-            scroll_to_end(wd)
+            # get image thumbnail results
+            thumbnail_results = wd.find_elements_by_css_selector(thumbnail_selector)
+            skipped_thumbnails = []
+            if skip_count:
+                skipped_thumbnails = thumbnail_results[:skip_count]
+                self._markThumbnailsProcessed(wd, skipped_thumbnails)
+                skip_count -= len(skipped_thumbnails)
+                thumbnail_results = thumbnail_results[len(skipped_thumbnails):]
+            new_thumbnails = thumbnail_results[window_start:]
 
-            # get all image thumbnail results
-            thumbnail_results = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["thumbnail"])
-            thumbnail_count = len(thumbnail_results)
+            # engine returns limited amount of results for one query, the rest of them is found by other shards
+            empty_scrolls_count = 0 if new_thumbnails or skipped_thumbnails else empty_scrolls_count + 1
+            if empty_scrolls_count >= MAX_EMPTY_SCROLLS:
+                print(f"No more search results for {search_query!r}")
+                break
             
-            print(f"Found: {thumbnail_count} search results. Extracting links from {results_start}:{thumbnail_count}")
+            print(f"Found: {len(new_thumbnails)} new search results. Extracting links from {results_start}:{results_start + len(new_thumbnails)}")
             
-            for image in thumbnail_results[results_start:thumbnail_count]: 
-                # if thread was terminated
-                if not self._running:
+            # candidates resolved without clicking (None for thumbnails which should be clicked)
+            extracted_candidates = self._extractCandidates(wd, search_engine, window_start, thumbnail_selector)
+            
+            processed_count = 0
+            for index, image in enumerate(new_thumbnails): 
+                # if thread was terminated or max_images_count was reached
+                if not self._isRunning():
                     break
+                processed_count = index + 1
 
-                try:
-                    image.click()
-                except:
-                    continue
+                if index < len(extracted_candidates) and extracted_candidates[index]:
+                    self._processCandidate(extracted_candidates[index])
+                else:
+                    try:
+                        with getRunMetrics().measure("click"):
+                            image.click()
+                    except:
+                        continue
 
-                # call processImage function depending on search engine
-                if SE_PROCESS_IMAGE[search_engine](wd, search_engine, min_resolution, max_resolution, valid_contentTypes, save_dir):
-                    downloaded_images_count += 1                    
-                    pub.sendMessage('downloadProgressChanged', progress=(downloaded_images_count * 100) // max_images_count)
-                    if downloaded_images_count >= max_images_count:
-                        break
+                    if self._pipeline:
+                        # only collect candidates, download workers will process them
+                        self._produceCandidates(wd, search_engine)
+                    else:
+                        self._downloadFirstCandidate(wd, search_engine)
+
+                if not multi:
+                    self._setResultsStart(results_start + index + 1)
             else:            
-                print("Found:", downloaded_images_count, "image links, looking for more ...")
+                print("Found:", self._getDownloadedImagesCount(), "image links, looking for more ...")
                 self._tryLoadMoreImages(wd, search_engine)
 
             # move the result startpoint further down
-            results_start = len(thumbnail_results)    
-        wd.close()        
+            if self._windowed_scroll:
+                self._markThumbnailsProcessed(wd, new_thumbnails[:processed_count])
+                results_start += processed_count
+            else:
+                results_start = max(results_start, len(thumbnail_results))
+
+    def _findImagesAndDownloadHttp(self, search_query, search_engine, search_filter=None):
+        try:
+            for candidates in SE_FIND_CANDIDATES_HTTP[search_engine](search_query, search_engine, self._cancel_token, search_filter):
+                print(f"Found: {len(candidates)} search results")
+
+                for candidate in candidates:
+                    # if thread was terminated or max_images_count was reached
+                    if not self._isRunning():
+                        break
+                    self._processCandidate(candidate)
+
+                if not self._isRunning():
+                    break
+        except OperationCancelled:
+            pass
+
+    # Runs every engine of multi engine in its own thread, all of them put candidates to the same pipeline,
+    # which drops urls already found by other engine. Engines stop when max_images_count is reached
+    def _findImagesAndDownloadMulti(self, search_query, search_engine):
+        engines = SEARCH_ENGINES[search_engine]["engines"]
+        shards = [createShard(engine, search_query, None) for engine in engines]
+        runQueryShards(shards, self._runShard, len(engines), lambda: True)
+
+    # Runs sub-queries of query (see QueryShards.planQueryShards) in shard_workers threads, all of them share
+    # the same pipeline (target and deduplication). New shard isn't launched once target is reached
+    def _findImagesAndDownloadSharded(self, search_query, search_engine):
+        engines = SEARCH_ENGINES[search_engine]["engines"] if isMultiSearchEngine(search_engine) else [search_engine]
+        shards_count = runQueryShards(planQueryShards(search_query, engines), self._runShard, self._shard_workers, self._isRunning)
+        print(f"Shards launched: {shards_count}")
+
+    def _runShard(self, shard):
+        print(f"Shard: {shard['search_engine']} {shard['search_query']!r} {shard['filter'] or ''}")
+        if isHttpSearchEngine(shard["search_engine"]):
+            self._findImagesAndDownloadHttp(shard["search_query"], shard["search_engine"], shard["filter"])
+        else:
+            self._findImagesAndDownload(shard["search_query"], shard["search_engine"], multi=True, search_filter=shard["filter"])
+
+    # Amount of threads which produce candidates in parallel (0 - single browser or http thread)
+    def _getProducersCount(self, search_engine):
+        if self._shard_workers > 0:
+            return self._shard_workers
+        if isMultiSearchEngine(search_engine):
+            return len(SEARCH_ENGINES[search_engine]["engines"])
+        return 0
 
-    def downloadImages(self, search_query, search_engine, max_images_count, min_resolution, max_resolution, valid_contentTypes, save_dir):        
+    # Returns amount of downloaded images (None if download failed)
+    # transform - post-download transform options (see ImageTransform.createTransformOptions), None to keep images as downloaded
+    def downloadImages(self, search_query, search_engine, max_images_count, min_resolution, max_resolution, valid_contentTypes, save_dir, transform=None):        
+        url_index = None
+        transformer = None
+        metrics = getRunMetrics()
+        metrics.reset()
+        getWaitStats().reset()
+        metrics_publisher = MetricsPublisher(metrics, self._onMetricsChanged)
+        metrics_publisher.start()
         try:
             # create directory where images will be saved
             Path(save_dir).mkdir(parents=True, exist_ok=True)
 
-            self._findImagesAndDownload(search_query, search_engine, max_images_count, min_resolution, max_resolution, valid_contentTypes, save_dir)
+            if self._url_index_path:
+                url_index = UrlIndex(self._url_index_path)
+            content_index = ContentIndex(save_dir) if self._content_dedup else None
+            if isTransformEnabled(transform):
+                transformer = ImageTransformer(transform)
+            self._downloader = ImageDownloader(min_resolution, max_resolution, valid_contentTypes, save_dir, url_index, content_index,
+                self._max_image_bytes, self._fsync, transformer, self._cancel_token, self._dir_levels)
+            self._search_query = search_query
+            if self._use_manifest:
+                self._manifest = ImageManifest(save_dir)
 
-            if self._running:
+            if self._resume:
+                job_params = {
+                    "search_query": search_query,
+                    "search_engine": search_engine,
+                    "max_images_count": max_images_count,
+                    "min_resolution": min_resolution,
+                    "max_resolution": max_resolution,
+                    "valid_contentTypes": valid_contentTypes
+                }
+                # journals of runs without transform stay compatible
+                if transformer:
+                    job_params["transform"] = transform
+                self._journal = RunJournal(save_dir, job_params)
+
+            self._max_images_count = max_images_count
+            # resumed run keeps counting toward the original target
+            self._downloaded_images_count = self._journal.downloaded_images_count if self._journal else 0
+            # candidates of parallel producers (engines, shards) are merged in pipeline, so it is needed even without download workers
+            producers_count = self._getProducersCount(search_engine)
+            self._pipeline = self._createPipeline(max(self._download_workers, producers_count) if producers_count else self._download_workers)
+
+            self._processPendingCandidates()
+
+            if self._shard_workers > 0:
+                self._findImagesAndDownloadSharded(search_query, search_engine)
+            elif isMultiSearchEngine(search_engine):
+                self._findImagesAndDownloadMulti(search_query, search_engine)
+            elif isHttpSearchEngine(search_engine):
+                self._findImagesAndDownloadHttp(search_query, search_engine)
+            else:
+                self._findImagesAndDownload(search_query, search_engine)
+
+            if self._pipeline:
+                # let download workers finish already collected candidates
+                self._pipeline.join()
+
+            downloaded_images_count = self._getDownloadedImagesCount()
+            if self._journal and downloaded_images_count >= max_images_count:
+                self._journal.finish()
+
+            if not self._cancel_token.isCancelled():
                 pub.sendMessage('downloadFinished')
+            return downloaded_images_count
+        except Exception as ex:
+            print("downloadImages: ", ex)
+        finally:
+            if self._pipeline:
+                self._pipeline.terminate()
+            if url_index:
+                url_index.close()
+            if transformer:
+                transformer.close()
+            if self._journal:
+                self._journal.close()
+            if self._manifest:
+                self._manifest.close()
+            metrics_publisher.stop()
+            self._writeMetricsReport(metrics, save_dir)
+
+        return None
+
+    def _writeMetricsReport(self, metrics, save_dir):
+        metrics.printReport()
+        getWaitStats().printReport()
+        try:
+            metrics.writeReport(save_dir)
         except Exception as ex:
-            print("downloadImages: ", ex)
\ No newline at end of file
+            print("_writeMetricsReport: ", ex)
\ No newline at end of file
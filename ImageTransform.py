@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+
+# Settings
+DEFAULT_TRANSFORM_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+DEFAULT_TRANSCODE_QUALITY = 90
+
+# Formats images can be transcoded to: PIL format name and content type
+TRANSCODE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# Options of post-download transform (all disabled by default)
+# downscale - fit images bigger than max resolution into it instead of rejecting them
+# format - transcode images to one of TRANSCODE_FORMATS (None - keep format)
+# quality - quality of transcoded (or downscaled) jpeg and webp images
+# strip_metadata - drop exif, icc profile and text chunks
+def createTransformOptions(downscale=False, format=None, quality=DEFAULT_TRANSCODE_QUALITY, strip_metadata=False):
+    if format and format not in TRANSCODE_FORMATS:
+        raise ValueError("Unknown transcode format: " + str(format))
+
+    return {
+        "downscale": downscale,
+        "format": format or None,
+        "quality": quality,
+        "strip_metadata": strip_metadata
+    }
+
+def isTransformEnabled(options):
+    return bool(options) and bool(options["downscale"] or options["format"] or options["strip_metadata"])
+
+# True if image with given resolution and content type has to be transformed
+def isTransformNeeded(options, resolution, content_type, max_resolution):
+    if not isTransformEnabled(options):
+        return False
+    if options["strip_metadata"]:
+        return True
+    if options["format"] and TRANSCODE_FORMATS[options["format"]][1] != content_type:
+        return True
+    return bool(options["downscale"] and resolution and (resolution[0] > max_resolution[0] or resolution[1] > max_resolution[1]))
+
+def _getSaveArgs(image, pil_format, options):
+    save_args = {}
+    if pil_format in ("JPEG", "WEBP"):
+        save_args["quality"] = options["quality"]
+    if not options["strip_metadata"]:
+        for key in ("exif", "icc_profile"):
+            if image.info.get(key):
+                save_args[key] = image.info[key]
+    return save_args
+
+# Runs in worker process: transforms image file in place (new extension if format changed).
+# Returns dict with file_path, resolution, content_type and file_size of result or None if image can't be transformed
+def transformImageFile(file_path, max_resolution, options):
+    from PIL import Image
+    from PIL import ImageOps
+
+    with Image.open(file_path) as image:
+        # frames of animations aren't resized one by one, such images are left as is
+        if getattr(image, "n_frames", 1) > 1:
+            return None
+
+        if options["format"]:
+            pil_format, content_type = TRANSCODE_FORMATS[options["format"]]
+        else:
+            # plugin of source format is already loaded, so its content type is known
+            pil_format, content_type = image.format, Image.MIME.get(image.format)
+        if not content_type:
+            return None
+        save_args = _getSaveArgs(image, pil_format, options)
+
+        if options["downscale"] and image.format == "JPEG":
+            # let decoder skip detail which is lost by downscale anyway (box of any orientation)
+            image.draft(image.mode, (max(max_resolution), max(max_resolution)))
+
+        if options["strip_metadata"]:
+            # orientation is applied to pixels, because exif with it is dropped
+            result = ImageOps.exif_transpose(image)
+        else:
+            image.load()
+            result = image
+
+        if options["downscale"] and (result.width > max_resolution[0] or result.height > max_resolution[1]):
+            result.thumbnail(max_resolution, Image.LANCZOS)
+
+        if (pil_format == "JPEG" and result.mode not in ("RGB", "L", "CMYK")) or (pil_format != "JPEG" and result.mode == "CMYK"):
+            result = result.convert("RGB")
+
+    # source file is closed before it is replaced (open file can't be replaced on Windows)
+    directory, file_name = os.path.split(file_path)
+    target_path = os.path.join(directory, os.path.splitext(file_name)[0] + "." + content_type.replace("image/", ""))
+
+    fd, temp_path = tempfile.mkstemp(suffix=".part", prefix="." + file_name + ".", dir=directory or ".")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            result.save(file, pil_format, **save_args)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if target_path != file_path:
+        os.remove(file_path)
+
+    return {
+        "file_path": target_path,
+        "resolution": result.size,
+        "content_type": content_type,
+        "file_size": os.path.getsize(target_path)
+    }
+
+# Process pool for CPU heavy image transforms, so they don't hold GIL of download threads.
+# Pool is started with the first transform
+class ImageTransformer:
+    def __init__(self, options, workers_count=DEFAULT_TRANSFORM_WORKERS):
+        self.options = options
+        self._workers_count = workers_count
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+
+    def isNeeded(self, resolution, content_type, max_resolution):
+        return isTransformNeeded(self.options, resolution, content_type, max_resolution)
+
+    # Blocks calling (download) thread until worker process transforms the file
+    def transform(self, file_path, max_resolution):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ImageTransformer is closed")
+            if not self._executor:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self._workers_count)
+        return self._executor.submit(transformImageFile, file_path, max_resolution, self.options).result()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Settings
+DEFAULT_JOB_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".ImageScrapper", "job_queue.sqlite3")
+DEFAULT_LEASE_TIME = 60 # seconds job stays claimed by worker without heartbeat
+DEFAULT_MAX_ATTEMPTS = 3 # job whose lease expired this many times is failed instead of queued again
+SQLITE_TIMEOUT = 30 # seconds to wait while other process writes to queue
+
+# Statuses of job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_STATUSES = [JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED]
+FINISHED_JOB_STATUSES = [JOB_DONE, JOB_FAILED, JOB_CANCELLED]
+
+JOB_COLUMNS = "id, input_values, status, worker, lease_expires_at, attempts, cancel_requested, progress, downloaded_images_count, error, created_at, updated_at"
+
+def _createJob(row):
+    return {
+        "id": row[0],
+        # fields of MainFrame.getInputValues (see ScrapeJob)
+        "input_values": json.loads(row[1]),
+        "status": row[2],
+        "worker": row[3],
+        "lease_expires_at": row[4],
+        "attempts": row[5],
+        "cancel_requested": bool(row[6]),
+        "progress": row[7],
+        "downloaded_images_count": row[8],
+        "error": row[9],
+        "created_at": row[10],
+        "updated_at": row[11]
+    }
+
+# Durable queue of scrape jobs (sqlite in WAL mode). Worker claims queued job with lease,
+# keeps lease with heartbeats and finishes job. Job whose lease expired (worker crashed or lost connection)
+# is queued again, run of the same job continues from run journal in its save dir
+class JobQueue:
+    def __init__(self, path=DEFAULT_JOB_QUEUE_PATH, lease_time=DEFAULT_LEASE_TIME, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # transactions are started explicitly, so claim is atomic across processes
+        self._connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                input_values TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                progress INTEGER NOT NULL DEFAULT 0,
+                downloaded_images_count INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _get(self, connection, job_id):
+        row = connection.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _createJob(row) if row else None
+
+    # Returns id of queued job
+    def submit(self, input_values):
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute("INSERT INTO jobs (input_values, status, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(input_values, ensure_ascii=False), JOB_QUEUED, now, now))
+            return cursor.lastrowid
+
+    # Returns job or None if there is no job with such id
+    def get(self, job_id):
+        with self._lock:
+            return self._get(self._connection, job_id)
+
+    # Returns jobs with given status (all jobs if status is None), oldest first
+    def list(self, status=None, limit=100):
+        with self._lock:
+            if status:
+                rows = self._connection.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = ? ORDER BY id LIMIT ?", (status, limit)).fetchall()
+            else:
+                rows = self._connection.execute(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [_createJob(row) for row in rows]
+
+    # Returns amount of jobs by status
+    def getCounts(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update(dict(rows))
+        return counts
+
+    # Returns the oldest queued job leased to worker or None if queue is empty
+    def claim(self, worker):
+        now = time.time()
+        with self._transaction() as connection:
+            self._reclaimExpiredLeases(connection, now)
+
+            row = connection.execute("SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (JOB_QUEUED,)).fetchone()
+            if not row:
+                return None
+
+            connection.execute("""
+                UPDATE jobs SET status = ?, worker = ?, lease_expires_at = ?, attempts = attempts + 1, error = NULL, updated_at = ?
+                WHERE id = ?""", (JOB_RUNNING, worker, now + self.lease_time, now, row[0]))
+            return self._get(connection, row[0])
+
+    def _reclaimExpiredLeases(self, connection, now):
+        expired = "status = ? AND lease_expires_at < ?"
+        connection.execute(f"UPDATE jobs SET status = ?, worker = NULL, lease_expires_at = NULL, updated_at = ? WHERE {expired} AND cancel_requested = 1",
+            (JOB_CANCELLED, now, JOB_RUNNING, now))
+        connection.execute(f"UPDATE jobs SET status = ?, worker = NULL, lease_expires_at = NULL, error = ?, updated_at = ? WHERE {expired} AND attempts >= ?",
+            (JOB_FAILED, "lease expired", now, JOB_RUNNING, now, self.max_attempts))
+        connection.execute(f"UPDATE jobs SET status = ?, worker = NULL, lease_expires_at = NULL, updated_at = ? WHERE {expired}",
+            (JOB_QUEUED, now, JOB_RUNNING, now))
+
+    # Extends lease of running job and stores its progress.
+    # Returns None if worker doesn't hold the lease anymore, otherwise dict with "cancel" flag
+    def heartbeat(self, job_id, worker, progress=None, downloaded_images_count=None):
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE jobs SET lease_expires_at = ?, progress = COALESCE(?, progress), downloaded_images_count = COALESCE(?, downloaded_images_count), updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?""", (now + self.lease_time, progress, downloaded_images_count, now, job_id, worker, JOB_RUNNING))
+            if cursor.rowcount == 0:
+                return None
+            cancel_requested = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            return {"cancel": bool(cancel_requested)}
+
+    # Finishes running job with one of FINISHED_JOB_STATUSES, returns False if worker doesn't hold the lease anymore
+    def finish(self, job_id, worker, status, downloaded_images_count=None, error=None):
+        if status not in FINISHED_JOB_STATUSES:
+            raise ValueError("Unknown finished job status: " + str(status))
+
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE jobs SET status = ?, lease_expires_at = NULL, progress = CASE WHEN ? = ? THEN 100 ELSE progress END,
+                    downloaded_images_count = COALESCE(?, downloaded_images_count), error = ?, updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?""",
+                (status, status, JOB_DONE, downloaded_images_count, error, now, job_id, worker, JOB_RUNNING))
+            return cursor.rowcount > 0
+
+    # Returns running job to queue (worker is stopping), interrupted attempt isn't counted
+    def release(self, job_id, worker):
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE jobs SET status = ?, worker = NULL, lease_expires_at = NULL, attempts = MAX(0, attempts - 1), updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?""", (JOB_QUEUED, now, job_id, worker, JOB_RUNNING))
+            return cursor.rowcount > 0
+
+    # Queued job is cancelled immediately, running job is cancelled by its worker with the next heartbeat.
+    # Returns job or None if there is no job with such id
+    def cancel(self, job_id):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?", (JOB_CANCELLED, now, job_id, JOB_QUEUED))
+            connection.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?", (now, job_id, JOB_RUNNING))
+            return self._get(connection, job_id)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,211 @@
+import re
+import sys
+import json
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from JobQueue import JobQueue
+from JobQueue import DEFAULT_JOB_QUEUE_PATH
+from JobQueue import DEFAULT_LEASE_TIME
+from JobQueue import DEFAULT_MAX_ATTEMPTS
+from JobQueue import JOB_STATUSES
+from SearchEngines import SEARCH_ENGINES
+from ScrapeJob import getDownloadArgs
+
+# Settings
+DEFAULT_HOST = "127.0.0.1" # only local workers and clients, use 0.0.0.0 to accept workers of other hosts
+DEFAULT_PORT = 8765
+MAX_REQUEST_BYTES = 1024 * 1024
+DEFAULT_JOBS_LIMIT = 100
+MAX_JOBS_LIMIT = 10000
+
+JOB_PATH_REGEX = re.compile(r"^/jobs/(\d+)(?:/(heartbeat|finish|release|cancel))?$")
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Small json api over JobQueue:
+#   POST /jobs                  - submit job (or list of jobs) with fields of MainFrame.getInputValues, returns ids
+#   GET  /jobs?status=&limit=   - list jobs
+#   GET  /jobs/<id>             - job with progress
+#   POST /jobs/<id>/cancel      - cancel job
+#   GET  /stats                 - amount of jobs by status
+# and api of workers (see JobWorker):
+#   POST /claim                 - lease the oldest queued job, 204 if queue is empty
+#   POST /jobs/<id>/heartbeat   - extend lease and report progress, 409 if lease was lost
+#   POST /jobs/<id>/finish      - finish job with status
+#   POST /jobs/<id>/release     - return job to queue
+class JobServer:
+    def __init__(self, job_queue, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.job_queue = job_queue
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self, "GET")
+
+            def do_POST(self):
+                server._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{self._server.server_address[0]}:{self._server.server_port}"
+        self._thread = None
+
+    def serveForever(self):
+        self._server.serve_forever()
+
+    # Serves requests in background thread
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, request, method):
+        url = urlparse(request.path)
+        try:
+            status, data = self._route(method, url.path, parse_qs(url.query), request)
+        except HttpError as ex:
+            status, data = ex.status, {"error": str(ex)}
+        except Exception as ex:
+            print("JobServer: ", ex)
+            status, data = 500, {"error": str(ex)}
+        self._send(request, status, data)
+
+    def _route(self, method, path, query, request):
+        if path == "/jobs" and method == "POST":
+            return 201, {"ids": self._submit(self._readJson(request))}
+        if path == "/jobs" and method == "GET":
+            status = query.get("status", [None])[0]
+            if status and status not in JOB_STATUSES:
+                raise HttpError(400, "Unknown job status: " + status)
+            return 200, {"jobs": self.job_queue.list(status, self._getLimit(query))}
+        if path == "/stats" and method == "GET":
+            return 200, self.job_queue.getCounts()
+        if path == "/claim" and method == "POST":
+            job = self.job_queue.claim(self._getWorker(self._readJson(request)))
+            return (200, dict(job, lease_time=self.job_queue.lease_time)) if job else (204, None)
+
+        match = JOB_PATH_REGEX.match(path)
+        if not match:
+            raise HttpError(404, "Not found: " + path)
+        job_id, action = int(match.group(1)), match.group(2)
+
+        if not action and method == "GET":
+            return 200, self._getJob(job_id)
+        if method != "POST":
+            raise HttpError(405, "Method not allowed")
+        if action == "cancel":
+            job = self.job_queue.cancel(job_id)
+            if not job:
+                raise HttpError(404, f"Job {job_id} not found")
+            return 200, job
+
+        data = self._readJson(request)
+        worker = self._getWorker(data)
+        if action == "heartbeat":
+            result = self.job_queue.heartbeat(job_id, worker, data.get("progress"), data.get("downloaded_images_count"))
+            if result is None:
+                raise HttpError(409, f"Job {job_id} isn't leased to {worker}")
+            return 200, result
+        if action == "finish":
+            try:
+                is_finished = self.job_queue.finish(job_id, worker, data.get("status"), data.get("downloaded_images_count"), data.get("error"))
+            except ValueError as ex:
+                raise HttpError(400, str(ex))
+            if not is_finished:
+                raise HttpError(409, f"Job {job_id} isn't leased to {worker}")
+            return 200, self._getJob(job_id)
+        if action == "release":
+            if not self.job_queue.release(job_id, worker):
+                raise HttpError(409, f"Job {job_id} isn't leased to {worker}")
+            return 200, self._getJob(job_id)
+        raise HttpError(404, "Not found: " + path)
+
+    # Validates jobs the same way batch runner does, nothing is queued if any job is invalid
+    def _submit(self, data):
+        jobs = data if isinstance(data, list) else [data]
+        for index, input_values in enumerate(jobs):
+            if not isinstance(input_values, dict):
+                raise HttpError(400, f"Job {index} isn't an object")
+            try:
+                getDownloadArgs(input_values, SEARCH_ENGINES)
+            except (ValueError, TypeError) as ex:
+                raise HttpError(400, f"Job {index}: {ex}")
+        return [self.job_queue.submit(input_values) for input_values in jobs]
+
+    def _getJob(self, job_id):
+        job = self.job_queue.get(job_id)
+        if not job:
+            raise HttpError(404, f"Job {job_id} not found")
+        return job
+
+    def _getLimit(self, query):
+        text = query.get("limit", [str(DEFAULT_JOBS_LIMIT)])[0]
+        try:
+            limit = int(text)
+        except ValueError:
+            limit = None
+        if limit is None or not 0 < limit <= MAX_JOBS_LIMIT:
+            raise HttpError(400, f"Limit must be a number from 1 to {MAX_JOBS_LIMIT}: {text}")
+        return limit
+
+    def _getWorker(self, data):
+        if not isinstance(data, dict) or not data.get("worker"):
+            raise HttpError(400, "Worker id is required")
+        return str(data["worker"])
+
+    def _readJson(self, request):
+        length = int(request.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            raise HttpError(413, "Request is too large")
+        try:
+            return json.loads(request.rfile.read(length) or b"{}")
+        except ValueError:
+            raise HttpError(400, "Request body isn't valid json")
+
+    def _send(self, request, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8") if data is not None else b""
+        try:
+            request.send_response(status)
+            if data is not None:
+                request.send_header("Content-Type", "application/json; charset=utf-8")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep scrape jobs in durable queue and lease them to JobWorker processes over local http api")
+    parser.add_argument("--db", default=DEFAULT_JOB_QUEUE_PATH, help="sqlite file of job queue")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (0.0.0.0 - accept workers of other hosts)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--lease-time", type=float, default=DEFAULT_LEASE_TIME, help="seconds job stays leased without heartbeat")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="expired leases before job is failed")
+    args = parser.parse_args(argv)
+
+    job_queue = JobQueue(args.db, args.lease_time, args.max_attempts)
+    job_server = JobServer(job_queue, args.host, args.port)
+    print(f"Job server on {job_server.url}, queue {args.db}: {job_queue.getCounts()}")
+    try:
+        job_server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        job_server.close()
+        job_queue.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
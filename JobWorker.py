@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+
+from ImageScrapper import ImageScrapper
+from HttpPool import configureHttpPool
+from HttpPool import getHostPoolSizes
+from HttpPool import parseHostPoolSize
+from HttpPool import DEFAULT_POOL_SIZE
+from BrowserPool import getBrowserPool
+from SearchEngines import SEARCH_ENGINES
+from ScrapeJob import getDownloadArgs
+from JobQueue import JOB_DONE
+from JobQueue import JOB_FAILED
+from JobQueue import JOB_CANCELLED
+from JobServer import DEFAULT_PORT
+
+# Settings
+DEFAULT_SERVER_URL = f"http://127.0.0.1:{DEFAULT_PORT}"
+DEFAULT_PROCESSES = 1
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_SHARD_WORKERS = 0
+DEFAULT_DIR_LEVELS = 0
+POLL_INTERVAL = 2 # seconds between claims while queue is empty
+SERVER_TIMEOUT = 10 # seconds to wait for job server response
+HEARTBEATS_PER_LEASE = 3 # lease isn't lost if one or two heartbeats fail
+
+def getWorkerId():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# Returns parsed json response, None for 204 (empty queue) and 409 (lease was lost)
+def _post(server_url, path, data):
+    import requests
+
+    response = requests.post(server_url + path, json=data, timeout=SERVER_TIMEOUT)
+    if response.status_code in (204, 409):
+        return None
+    response.raise_for_status()
+    return response.json()
+
+# Runs one leased job with heartbeats, returns (status, downloaded images count, error).
+# Job is cancelled when server asks for it or lease is lost
+def runJob(server_url, worker, job, scrapper_options):
+    import requests
+
+    try:
+        download_args = getDownloadArgs(job["input_values"], SEARCH_ENGINES)
+    except (ValueError, TypeError) as ex:
+        return JOB_FAILED, None, str(ex)
+
+    image_scrapper = ImageScrapper(browser_pool=getBrowserPool(), **scrapper_options)
+    result = {}
+    def download():
+        result["downloaded_images_count"] = image_scrapper.downloadImages(**download_args)
+    thread = threading.Thread(target=download, daemon=True)
+    thread.start()
+
+    heartbeat_interval = job["lease_time"] / HEARTBEATS_PER_LEASE
+    is_cancelled = False
+    try:
+        while thread.is_alive():
+            thread.join(heartbeat_interval)
+            if not thread.is_alive() or is_cancelled:
+                continue
+
+            progress_state = image_scrapper.getProgressState()
+            try:
+                heartbeat = _post(server_url, f"/jobs/{job['id']}/heartbeat",
+                    {"worker": worker, "progress": progress_state["progress"], "downloaded_images_count": progress_state["downloaded_images_count"]})
+            except requests.RequestException as ex:
+                print("runJob: ", ex)
+                continue
+
+            if heartbeat is None or heartbeat["cancel"]:
+                print(f"Job {job['id']}: " + ("lease lost" if heartbeat is None else "cancelled"))
+                is_cancelled = True
+                image_scrapper.terminate()
+    except BaseException:
+        # worker is stopping, run journal lets next worker continue the job
+        image_scrapper.terminate()
+        thread.join()
+        raise
+
+    downloaded_images_count = result.get("downloaded_images_count")
+    if is_cancelled:
+        return JOB_CANCELLED, downloaded_images_count, None
+    if downloaded_images_count is None:
+        return JOB_FAILED, None, "download error"
+    return JOB_DONE, downloaded_images_count, None
+
+# Claims and runs jobs until interrupted
+def runWorker(server_url, scrapper_options, poll_interval=POLL_INTERVAL):
+    import requests
+
+    worker = getWorkerId()
+    print(f"Worker {worker} of {server_url}")
+    while True:
+        try:
+            job = _post(server_url, "/claim", {"worker": worker})
+        except requests.RequestException as ex:
+            print("runWorker: ", ex)
+            job = None
+
+        if not job:
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Job {job['id']}: {job['input_values'].get('search_query')!r} (attempt {job['attempts']})")
+        try:
+            status, downloaded_images_count, error = runJob(server_url, worker, job, scrapper_options)
+        except KeyboardInterrupt:
+            _tryPost(server_url, f"/jobs/{job['id']}/release", {"worker": worker})
+            raise
+
+        print(f"Job {job['id']}: {status}, {downloaded_images_count} images" + (f" ({error})" if error else ""))
+        _tryPost(server_url, f"/jobs/{job['id']}/finish",
+            {"worker": worker, "status": status, "downloaded_images_count": downloaded_images_count, "error": error})
+
+def _tryPost(server_url, path, data):
+    import requests
+
+    try:
+        return _post(server_url, path, data)
+    except requests.RequestException as ex:
+        print("JobWorker: ", ex)
+        return None
+
+def _runWorkerProcess(server_url, scrapper_options, poll_interval, pool_size, host_pool_sizes):
+    configureHttpPool(pool_size, host_pool_sizes)
+    try:
+        runWorker(server_url, scrapper_options, poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        getBrowserPool().close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scrape jobs leased from JobServer, start more workers (on any host) to add capacity")
+    parser.add_argument("--server", default=DEFAULT_SERVER_URL, help="url of job server")
+    parser.add_argument("-p", "--processes", type=int, default=DEFAULT_PROCESSES, help="amount of worker processes (each runs one job at a time with own browser)")
+    parser.add_argument("-w", "--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="download threads per worker process")
+    parser.add_argument("-s", "--shard-workers", type=int, default=DEFAULT_SHARD_WORKERS, help="split every query into shards run by this amount of threads (0 - single query)")
+    parser.add_argument("--dir-levels", type=int, default=DEFAULT_DIR_LEVELS, help="save images to this many levels of hash prefix subdirectories (0 - directly to save dir)")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="seconds between claims while queue is empty")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="kept-alive connections per image host")
+    parser.add_argument("--host-pool-size", nargs="+", type=parseHostPoolSize, default=[], metavar="HOST=SIZE", help="kept-alive connections of hosts which serve many images")
+    args = parser.parse_args(argv)
+
+    scrapper_options = {"download_workers": args.download_workers, "shard_workers": args.shard_workers, "dir_levels": args.dir_levels}
+    server_url = args.server.rstrip("/")
+    processes = [multiprocessing.Process(target=_runWorkerProcess, args=(server_url, scrapper_options, args.poll_interval, args.pool_size, getHostPoolSizes(args.host_pool_size))) for _ in range(max(1, args.processes))]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # worker processes get the same interrupt and release their jobs
+        for process in processes:
+            process.join()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,14 +3,16 @@ import io
 import json
 from pathlib import Path
 from threading import Thread
-from ImageScrapper import ImageScrapper
+from ScrapeJob import getImageContentTypes
+from ScrapeJob import getTransformOptions
+from ProgressBus import ProgressBus
 from pubsub import pub
 
 from wx import *
 
 # Main Window Consts
 WINDOW_TITLE = "Завантаження зображень"
-WINDOW_SIZE = (536, 430)
+WINDOW_SIZE = (536, 480)
 WINDOW_STYLE = wx.MINIMIZE_BOX | wx.SYSTEM_MENU | wx.CAPTION | wx.CLOSE_BOX | wx.CLIP_CHILDREN
 
 # Element consts
@@ -22,7 +24,23 @@ TEXT_FONT_SIZE = 12
 TEXT_INPUT_FONT_SIZE = 12
 
 # Other
-SEARCH_ENGINES = ["Google", "DuckDuckGo"]
+SEARCH_ENGINES = ["Google", "DuckDuckGo", "DuckDuckGo HTTP", "Multi"]
+DOWNLOAD_WORKERS = 4 # amount of threads downloading images while browser collects next candidates
+SHARD_WORKERS = 2 # amount of threads running sub-queries of big downloads
+SHARDING_MIN_IMAGES_COUNT = 400 # one query of engine rarely returns more results
+
+# Rejected candidates shown under progress
+REJECT_LABELS = {
+    "invalid_url": "невірні посилання",
+    "invalid_content_type": "інший формат",
+    "too_small": "замалі",
+    "too_big": "завеликі",
+    "too_large_file": "завеликі файли",
+    "unknown_resolution": "невідомий розмір",
+    "duplicate": "дублікати",
+    "timeout": "таймаути",
+    "error": "помилки",
+}
 
 # Default values for each input
 INPUT_DEFAULT_VALUES = {
@@ -36,13 +54,27 @@ INPUT_DEFAULT_VALUES = {
     "max_resolution_height": 1080,    
     "image_extension_jpg": True,
     "image_extension_png": True,
-    "image_extension_gif": False
+    "image_extension_gif": False,
+    "downscale_oversized": False
 }
 
 # Function for easy placing elements
 def GetNextPos(prevElement, leftMargin = ELEMENT_LEFT_MARGIN, topMargin = ELEMENT_TOP_MARGIN):
     return (leftMargin, prevElement.GetPosition().y + prevElement.GetSize().y + topMargin)
 
+def FormatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+# Returns progress line and rejects line for state of ProgressBus
+def FormatProgressState(state):
+    eta = FormatDuration(state["eta"]) if state["eta"] is not None else "?"
+    progress_text = (f"{state['downloaded_images_count']}/{state['max_images_count']} зображень, "
+        f"{state['images_per_second']:.1f} зобр/с, {state['bytes_per_second'] / (1024 * 1024):.1f} МБ/с, "
+        f"переглянуто {state['candidates_count']}, залишилось {eta}")
+    rejects = ", ".join(f"{REJECT_LABELS.get(outcome, outcome)} {count}" for outcome, count in sorted(state["rejects"].items(), key=lambda item: -item[1]))
+    return progress_text, "Відхилено: " + (rejects or "0")
+
 class MainFrame(wx.Frame):    
     def __init__(self):
         # Fonts
@@ -124,6 +156,10 @@ class MainFrame(wx.Frame):
         self.image_extension_gif = wx.CheckBox(panel, label="GIF", pos=GetNextPos(self.image_extension_label, leftMargin=150), size=(60, -1))
         self.image_extension_gif.SetFont(TEXT_FONT)
 
+        # Downscale images bigger than max resolution instead of skipping them
+        self.downscale_oversized = wx.CheckBox(panel, label="Зменшувати завеликі", pos=GetNextPos(self.image_extension_label, leftMargin=260), size=(250, -1))
+        self.downscale_oversized.SetFont(TEXT_FONT)
+
 
         # Download
         self.download = wx.Button(panel, label="Завантажити", pos=GetNextPos(self.image_extension_gif, topMargin=10), size=(200, 30))
@@ -131,6 +167,10 @@ class MainFrame(wx.Frame):
         # Gauge progress
         self.gauge = wx.Gauge(panel, range=100, pos=GetNextPos(self.image_extension_gif, topMargin=10, leftMargin=230), size=(280, 30))        
 
+        # Throughput, ETA and rejected candidates of current run
+        self.progress_text = wx.StaticText(panel, pos=GetNextPos(self.download, topMargin=6), size=(500, -1), label="")
+        self.rejects_text = wx.StaticText(panel, pos=GetNextPos(self.progress_text), size=(500, -1), label="")
+
         # Menu
         self.initMenu()
 
@@ -142,20 +182,53 @@ class MainFrame(wx.Frame):
         self.download.Bind(wx.EVT_BUTTON, self.onDownloadClick)
         self.Bind(wx.EVT_CLOSE, self.onClose)
 
-        # Subscribes
-        pub.subscribe(self.onDownloadProgressChanged, 'downloadProgressChanged')
-        pub.subscribe(self.onDownloadFinished, 'downloadFinished')        
+        # Subscribes (messages are sent from download thread, handlers are run on GUI thread)
+        pub.subscribe(self.onDownloadFinishedMessage, 'downloadFinished')        
 
         # Properties
         self.current_settings_path = None
         self.updateProjectNameInTitle()
 
         self._image_scrapper = None        
+        self._progress_bus = None
+
+        self._browser_pool = None
+        self._backend_thread = None
+        self._is_closing = False
 
         # Show form
         self.Center()
         self.Show()
 
+        # backend is loaded after window appears, browser starts while user fills the form
+        wx.CallAfter(self.startLoadingBackend)
+
+    def startLoadingBackend(self):
+        if not self._backend_thread:
+            self._backend_thread = Thread(target=self._loadBackend, daemon=True)
+            self._backend_thread.start()
+
+    def _loadBackend(self):
+        try:
+            from BrowserPool import getBrowserPool
+            from ImageScrapper import warmUpBackend
+            self._browser_pool = getBrowserPool()
+            warmUpBackend(self._browser_pool)
+        except Exception as ex:
+            print("_loadBackend: ", ex)
+
+    # Calls callback on GUI thread when backend is loaded, GUI thread doesn't wait for it
+    def callAfterBackendLoaded(self, callback, *args):
+        self.startLoadingBackend()
+        if not self._backend_thread.is_alive():
+            callback(*args)
+            return
+
+        def waitForBackend():
+            self._backend_thread.join()
+            wx.CallAfter(callback, *args)
+        Thread(target=waitForBackend, daemon=True).start()
+
     def getInputValues(self):
         return {
             "search_query": self.search_query.GetValue(),
@@ -168,7 +241,8 @@ class MainFrame(wx.Frame):
             "max_resolution_height": self.max_resolution_height.GetValue(),    
             "image_extension_jpg": self.image_extension_jpg.GetValue(),
             "image_extension_png": self.image_extension_png.GetValue(),
-            "image_extension_gif": self.image_extension_gif.GetValue()
+            "image_extension_gif": self.image_extension_gif.GetValue(),
+            "downscale_oversized": self.downscale_oversized.GetValue()
         }
 
     def setInputValues(self, input_values):     
@@ -183,6 +257,8 @@ class MainFrame(wx.Frame):
         self.image_extension_jpg.SetValue(input_values["image_extension_jpg"])
         self.image_extension_png.SetValue(input_values["image_extension_png"])
         self.image_extension_gif.SetValue(input_values["image_extension_gif"])
+        # projects saved before this option was added don't have it
+        self.downscale_oversized.SetValue(input_values.get("downscale_oversized", False))
 
     def initMenu(self):    
         menu_bar = wx.MenuBar() 
@@ -299,17 +375,7 @@ class MainFrame(wx.Frame):
             wx.MessageBox("Виберіть пошукову систему зі списку!")
             return
 
-        image_contentTypes = []
-        
-        if self.image_extension_jpg.IsChecked():
-            image_contentTypes.append("image/jpg")
-            image_contentTypes.append("image/jpeg")
-
-        if self.image_extension_png.IsChecked():
-            image_contentTypes.append("image/png")
-
-        if self.image_extension_gif.IsChecked():
-            image_contentTypes.append("image/gif")
+        image_contentTypes = getImageContentTypes(self.getInputValues())
 
         if len(image_contentTypes) == 0:
             wx.MessageBox("Виберіть хоча б одне розширення зображення!")
@@ -318,29 +384,72 @@ class MainFrame(wx.Frame):
         minResolution = (self.min_resolution_width.Value, self.min_resolution_height.Value)
         maxResolution = (self.max_resolution_width.Value, self.max_resolution_height.Value)        
 
-        self._image_scrapper = ImageScrapper()
-        Thread(target=self._image_scrapper.downloadImages,
-            args=(self.search_query.Value, 
+        shard_workers = SHARD_WORKERS if self.max_images_count.Value > SHARDING_MIN_IMAGES_COUNT else 0
+        download_args = (self.search_query.Value, 
             self.search_engine.Value, 
             self.max_images_count.Value, 
             minResolution, 
             maxResolution,
             image_contentTypes,
-            self.save_dir.Path)).start()
+            self.save_dir.Path)
 
         self.gauge.SetValue(0)
         self.download.Enabled = False
 
-    def onDownloadProgressChanged(self, progress):
-        self.gauge.SetValue(progress)
+        # usually loaded long ago, first click right after start waits for it
+        self.callAfterBackendLoaded(self.startDownload, download_args, getTransformOptions(self.getInputValues()), shard_workers)
+
+    def startDownload(self, download_args, transform_options, shard_workers):
+        # window was closed while backend was loading
+        if not self or self._is_closing:
+            return
+
+        from ImageScrapper import ImageScrapper
+        self._image_scrapper = ImageScrapper(download_workers=DOWNLOAD_WORKERS, browser_pool=self._browser_pool, shard_workers=shard_workers)
+        Thread(target=self._image_scrapper.downloadImages, args=download_args, kwargs={"transform": transform_options}).start()
+
+        # progress is polled at fixed rate, however many images per second are downloaded
+        self._stopProgressBus()
+        self._progress_bus = ProgressBus(self._image_scrapper.getProgressState, self.onDownloadStateChanged, wx.CallAfter)
+        self._progress_bus.start()
+
+    def onDownloadStateChanged(self, state):
+        # frame can be already destroyed when last update arrives
+        if not self:
+            return
+        progress_text, rejects_text = FormatProgressState(state)
+        self.gauge.SetValue(state["progress"])
+        self.progress_text.SetLabel(progress_text)
+        self.rejects_text.SetLabel(rejects_text)
+
+    def onDownloadFinishedMessage(self):
+        wx.CallAfter(self.onDownloadFinished)
 
     def onDownloadFinished(self):
+        if not self:
+            return
+        self._stopProgressBus()
         wx.MessageBox("Завантаження завершено!")
         self.download.Enabled = True
 
+    def _stopProgressBus(self):
+        if self._progress_bus:
+            self._progress_bus.stop()
+            self._progress_bus = None
+
     def onClose(self, event):
+        self._is_closing = True
         if self._image_scrapper:
             self._image_scrapper.terminate()
+        self._stopProgressBus()
+        if self._backend_thread and self._backend_thread.is_alive() and event.CanVeto():
+            # browser which is starting is closed with the pool, window is closed again when backend is loaded
+            event.Veto()
+            self.Hide()
+            self.callAfterBackendLoaded(self.Close)
+            return
+        if self._browser_pool:
+            self._browser_pool.close()
         event.Skip()
 
 if __name__ == '__main__':
@@ -0,0 +1,229 @@
+import io
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from BrowserWaits import getWaitStats
+from HttpPool import getHttpPoolStats
+from HostScheduler import HOST_COUNTERS
+from HostScheduler import getHostScheduler
+
+# Settings
+METRICS_PUBLISH_INTERVAL = 2 # seconds between snapshots published during run
+METRICS_JSON_FILE_NAME = ".metrics.json" # reports are written to save dir at the end of run
+METRICS_PROMETHEUS_FILE_NAME = ".metrics.prom"
+PROMETHEUS_PREFIX = "imagescrapper_"
+STAGE_SAMPLES_COUNT = 1000 # latest stage times kept for percentiles
+PERCENTILES = (50, 90, 99)
+
+# Nearest-rank percentile of sorted values
+def getPercentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, (len(sorted_values) * percentile + 99) // 100 - 1))
+    return sorted_values[index]
+
+# Time spent in every stage of a run (browser, search, request, probe, write ...),
+# outcomes of processed candidates, downloaded bytes, reuse of pooled connections and requests to every host
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        http_pool_stats = getHttpPoolStats()
+        host_stats = getHostScheduler().getStats()
+        with self._lock:
+            self._start_time = time.monotonic()
+            self._stages = {}
+            self._samples = {} # stage -> latest stage times
+            self._outcomes = {}
+            self._downloaded_bytes = 0
+            # http pool counts requests of the whole process, run reports the difference
+            self._http_pool_start_stats = http_pool_stats
+            self._host_start_stats = host_stats
+
+    # Times block as stage, exception raised in block is counted as stage error
+    @contextmanager
+    def measure(self, stage):
+        start_time = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.addStageTime(stage, time.monotonic() - start_time, failed)
+
+    def addStageTime(self, stage, stage_time, failed=False):
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["count"] += 1
+            stats["total_time"] += stage_time
+            stats["max_time"] = max(stats["max_time"], stage_time)
+            self._samples.setdefault(stage, deque(maxlen=STAGE_SAMPLES_COUNT)).append(stage_time)
+            if failed:
+                stats["errors"] += 1
+
+    def addOutcome(self, outcome, file_size=None):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+            if file_size:
+                self._downloaded_bytes += file_size
+
+    # Counts of run without stage statistics (cheap enough to be read many times per second)
+    def getCounters(self):
+        with self._lock:
+            return {
+                "run_time": time.monotonic() - self._start_time,
+                "outcomes": dict(self._outcomes),
+                "candidates_count": sum(self._outcomes.values()),
+                "downloaded_bytes": self._downloaded_bytes
+            }
+
+    def getSnapshot(self):
+        http_pool_stats = getHttpPoolStats()
+        host_stats = getHostScheduler().getStats()
+        with self._lock:
+            run_time = time.monotonic() - self._start_time
+            stages = {}
+            for stage, stats in self._stages.items():
+                stages[stage] = dict(stats)
+                stages[stage]["avg_time"] = stats["total_time"] / stats["count"] if stats["count"] else 0.0
+                samples = sorted(self._samples.get(stage, ()))
+                for percentile in PERCENTILES:
+                    stages[stage][f"p{percentile}_time"] = getPercentile(samples, percentile)
+
+            return {
+                "time": time.time(),
+                "run_time": run_time,
+                "stages": stages,
+                "outcomes": dict(self._outcomes),
+                "candidates_count": sum(self._outcomes.values()),
+                "downloaded_bytes": self._downloaded_bytes,
+                "bytes_per_second": self._downloaded_bytes / run_time if run_time > 0 else 0.0,
+                "waits": getWaitStats().get(),
+                "http_pool": {key: max(0, value - self._http_pool_start_stats.get(key, 0)) for key, value in http_pool_stats.items()},
+                "hosts": _getHostStatsSince(host_stats, self._host_start_stats)
+            }
+
+    def printReport(self):
+        snapshot = self.getSnapshot()
+        print(f"Run: {snapshot['run_time']:.1f}s, {snapshot['candidates_count']} candidates, {snapshot['downloaded_bytes'] // 1024} KB downloaded")
+        for stage, stats in sorted(snapshot["stages"].items(), key=lambda item: -item[1]["total_time"]):
+            print(f"Stage '{stage}': {stats['count']} times, total {stats['total_time']:.2f}s, avg {stats['avg_time']:.3f}s, p90 {stats['p90_time']:.3f}s, max {stats['max_time']:.2f}s, {stats['errors']} errors")
+        for outcome, count in sorted(snapshot["outcomes"].items()):
+            print(f"Outcome '{outcome}': {count}")
+        http_pool = snapshot["http_pool"]
+        print(f"Http pool: {http_pool['requests']} requests, {http_pool['hits']} over kept-alive connections, {http_pool['misses']} new connections")
+        hosts = snapshot["hosts"]
+        print(f"Hosts: {len(hosts['hosts'])} hosts, {hosts['requests']} requests, {hosts['retries']} retries, {hosts['throttled']} throttled")
+        for host, stats in sorted(hosts["hosts"].items()):
+            if stats["retries"] or stats["throttled"]:
+                print(f"Host '{host}': {stats['requests']} requests, {stats['retries']} retries, {stats['throttled']} throttled, concurrency {stats['concurrency_limit']}")
+
+    # Writes JSON and Prometheus text format reports to directory, returns paths of written files
+    def writeReport(self, directory):
+        snapshot = self.getSnapshot()
+        json_path = os.path.join(directory, METRICS_JSON_FILE_NAME)
+        prometheus_path = os.path.join(directory, METRICS_PROMETHEUS_FILE_NAME)
+
+        with io.open(json_path, 'w', encoding='utf-8') as report:
+            json.dump(snapshot, report, indent=4)
+        with io.open(prometheus_path, 'w', encoding='utf-8') as report:
+            report.write(formatPrometheus(snapshot))
+
+        return json_path, prometheus_path
+
+# Counters of host scheduler since start stats for hosts requested since then, concurrency limits are current
+def _getHostStatsSince(stats, start_stats):
+    hosts = {}
+    for host, host_stats in stats["hosts"].items():
+        start_host_stats = start_stats["hosts"].get(host, {})
+        counters = {key: max(0, host_stats[key] - start_host_stats.get(key, 0)) for key in HOST_COUNTERS}
+        if counters["requests"]:
+            hosts[host] = dict(host_stats, **counters)
+    return dict({key: max(0, stats[key] - start_stats[key]) for key in HOST_COUNTERS}, hosts=hosts)
+
+def _formatMetric(lines, name, metric_type, help_text, samples):
+    lines.append(f"# HELP {PROMETHEUS_PREFIX}{name} {help_text}")
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {metric_type}")
+    for suffix, labels, value in samples:
+        label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+        lines.append(f"{PROMETHEUS_PREFIX}{name}{suffix}{{{label_text}}} {value}" if label_text else f"{PROMETHEUS_PREFIX}{name}{suffix} {value}")
+
+# Formats snapshot in Prometheus text exposition format
+def formatPrometheus(snapshot):
+    lines = []
+    stages = sorted(snapshot["stages"].items())
+    waits = sorted(snapshot["waits"].items())
+
+    _formatMetric(lines, "stage_seconds", "summary", "Time spent in run stage",
+        [("", {"stage": stage, "quantile": str(percentile / 100)}, stats[f"p{percentile}_time"]) for stage, stats in stages for percentile in PERCENTILES] +
+        [("_sum", {"stage": stage}, stats["total_time"]) for stage, stats in stages] +
+        [("_count", {"stage": stage}, stats["count"]) for stage, stats in stages])
+    _formatMetric(lines, "stage_max_seconds", "gauge", "Longest single run of stage",
+        [("", {"stage": stage}, stats["max_time"]) for stage, stats in stages])
+    _formatMetric(lines, "stage_errors_total", "counter", "Stage runs which raised an error",
+        [("", {"stage": stage}, stats["errors"]) for stage, stats in stages])
+    _formatMetric(lines, "candidates_total", "counter", "Processed image candidates by outcome",
+        [("", {"outcome": outcome}, count) for outcome, count in sorted(snapshot["outcomes"].items())])
+    _formatMetric(lines, "wait_seconds", "summary", "Time spent waiting for browser condition",
+        [("_sum", {"wait": name}, stats["total_time"]) for name, stats in waits] +
+        [("_count", {"wait": name}, stats["count"]) for name, stats in waits])
+    _formatMetric(lines, "wait_timeouts_total", "counter", "Browser waits which timed out",
+        [("", {"wait": name}, stats["timeouts"]) for name, stats in waits])
+    _formatMetric(lines, "http_requests_total", "counter", "Requests sent through shared http pool",
+        [("", {}, snapshot["http_pool"]["requests"])])
+    _formatMetric(lines, "http_connections_total", "counter", "Requests of shared http pool by connection they used",
+        [("", {"connection": "reused"}, snapshot["http_pool"]["hits"]), ("", {"connection": "new"}, snapshot["http_pool"]["misses"])])
+    hosts = sorted(snapshot["hosts"]["hosts"].items())
+    _formatMetric(lines, "host_requests_total", "counter", "Requests admitted by host scheduler",
+        [("", {"host": host}, stats["requests"]) for host, stats in hosts])
+    _formatMetric(lines, "host_retries_total", "counter", "Retries of requests to host",
+        [("", {"host": host}, stats["retries"]) for host, stats in hosts])
+    _formatMetric(lines, "host_throttled_total", "counter", "Requests to host which were throttled (429, 503, timeout, reset connection)",
+        [("", {"host": host}, stats["throttled"]) for host, stats in hosts])
+    _formatMetric(lines, "host_concurrency_limit", "gauge", "Current limit of requests in flight to host",
+        [("", {"host": host}, stats["concurrency_limit"]) for host, stats in hosts])
+    _formatMetric(lines, "downloaded_bytes_total", "counter", "Bytes of saved images",
+        [("", {}, snapshot["downloaded_bytes"])])
+    _formatMetric(lines, "run_seconds", "gauge", "Duration of run",
+        [("", {}, snapshot["run_time"])])
+
+    return "\n".join(lines) + "\n"
+
+# Calls callback with metrics snapshot every interval seconds until stopped
+class MetricsPublisher:
+    def __init__(self, metrics, callback, interval=METRICS_PUBLISH_INTERVAL):
+        self._metrics = metrics
+        self._callback = callback
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # Stops publishing, last snapshot is published once more
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._publish()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._publish()
+
+    def _publish(self):
+        try:
+            self._callback(self._metrics.getSnapshot())
+        except Exception as ex:
+            print("MetricsPublisher: ", ex)
+
+_run_metrics = RunMetrics()
+
+def getRunMetrics():
+    return _run_metrics
@@ -0,0 +1,82 @@
+import threading
+
+from SearchEngines import OUTCOME_DOWNLOADED
+from SearchEngines import OUTCOME_CANCELLED
+
+# Settings
+PROGRESS_REFRESH_INTERVAL = 0.1 # seconds between progress updates delivered to UI
+
+# Progress of run: counts, throughput, rejected candidates by outcome and ETA (seconds, None while unknown)
+# counters - Metrics.RunMetrics.getCounters() of run,
+# downloaded_images_count - images downloaded toward max_images_count (including resumed ones)
+def getProgressState(counters, downloaded_images_count, max_images_count):
+    run_time = counters["run_time"]
+    outcomes = counters["outcomes"]
+    images_per_second = outcomes.get(OUTCOME_DOWNLOADED, 0) / run_time if run_time > 0 else 0.0
+    remaining_images_count = max(0, max_images_count - downloaded_images_count)
+
+    eta = None
+    if remaining_images_count == 0:
+        eta = 0.0
+    elif images_per_second > 0:
+        eta = remaining_images_count / images_per_second
+
+    return {
+        "run_time": run_time,
+        "downloaded_images_count": downloaded_images_count,
+        "max_images_count": max_images_count,
+        "progress": min(100, (downloaded_images_count * 100) // max_images_count) if max_images_count else 0,
+        "images_per_second": images_per_second,
+        "bytes_per_second": counters["downloaded_bytes"] / run_time if run_time > 0 else 0.0,
+        "candidates_count": counters["candidates_count"],
+        "rejects": {outcome: count for outcome, count in outcomes.items() if outcome not in (OUTCOME_DOWNLOADED, OUTCOME_CANCELLED)},
+        "eta": eta
+    }
+
+# Delivers state of run to UI at fixed refresh rate, however often backend changes it.
+# source() is polled in background thread, callback(state) is run with dispatch (e.g. wx.CallAfter on GUI thread).
+# Next state isn't dispatched until callback of previous one was run, so slow UI never gets a queue of updates
+class ProgressBus:
+    def __init__(self, source, callback, dispatch, interval=PROGRESS_REFRESH_INTERVAL):
+        self._source = source
+        self._callback = callback
+        self._dispatch = dispatch
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._pending = False
+        self._last_state = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # Stops polling, final state is dispatched even if previous one is still pending
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._deliver(final=True)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._deliver()
+
+    def _deliver(self, final=False):
+        try:
+            state = self._source()
+        except Exception as ex:
+            print("ProgressBus: ", ex)
+            return
+
+        with self._lock:
+            if (self._pending and not final) or state == self._last_state:
+                return
+            self._pending = True
+            self._last_state = state
+        self._dispatch(self._onDispatched, state)
+
+    def _onDispatched(self, state):
+        with self._lock:
+            self._pending = False
+        self._callback(state)
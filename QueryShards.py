@@ -0,0 +1,63 @@
+import threading
+
+from SearchEngines import getSearchFilters
+
+# Settings
+DEFAULT_SHARD_WORKERS = 4
+# terms appended to query after all filters of engines were used with the whole query
+SHARD_SUFFIX_TERMS = ["photo", "wallpaper", "hd", "art", "background", "closeup", "illustration", "drawing", "vintage", "black and white",
+    "night", "nature", "portrait", "landscape", "texture", "pattern", "minimal", "aesthetic", "high resolution", "4k"]
+
+def createShard(search_engine, search_query, search_filter):
+    return {
+        "search_engine": search_engine,
+        "search_query": search_query,
+        "filter": search_filter
+    }
+
+# Yields sub-queries of one job, which together return much more results than result cap of one query:
+# whole query first, then query narrowed by every filter of engines, then the same for query with every suffix term.
+# Engines take turns, so all of them work on the most relevant shards first
+def planQueryShards(search_query, search_engines, suffix_terms=SHARD_SUFFIX_TERMS):
+    queries = [search_query] + [search_query + " " + term for term in suffix_terms if term.lower() not in search_query.lower()]
+    filters = {search_engine: getSearchFilters(search_engine) for search_engine in search_engines}
+    filters_count = max(len(engine_filters) for engine_filters in filters.values())
+
+    for query in queries:
+        for filter_index in range(filters_count):
+            for search_engine in search_engines:
+                if filter_index < len(filters[search_engine]):
+                    yield createShard(search_engine, query, filters[search_engine][filter_index])
+
+# Runs shards with run_shard(shard) in workers_count threads, next shard is launched only while is_running() is true
+# (e.g. shared target isn't reached). Returns amount of launched shards
+def runQueryShards(shards, run_shard, workers_count, is_running):
+    shards = iter(shards)
+    lock = threading.Lock()
+    launched_shards = []
+
+    def getNextShard():
+        with lock:
+            if not is_running():
+                return None
+            shard = next(shards, None)
+            if shard:
+                launched_shards.append(shard)
+            return shard
+
+    def worker():
+        shard = getNextShard()
+        while shard:
+            try:
+                run_shard(shard)
+            except Exception as ex:
+                print("runQueryShards: ", ex)
+            shard = getNextShard()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers_count))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return len(launched_shards)
@@ -0,0 +1,135 @@
+import io
+import os
+import json
+import time
+import threading
+
+from SearchEngines import OUTCOME_DOWNLOADED
+
+# Settings
+RUN_JOURNAL_FILE_NAME = ".run_journal.jsonl"
+
+# Incremental log of a run in save dir: job parameters, harvested candidates,
+# processed candidates with outcomes and position in search results.
+# Run of the same job after crash continues from the journal
+class RunJournal:
+    def __init__(self, save_dir, job_params):
+        self.path = os.path.join(save_dir, RUN_JOURNAL_FILE_NAME)
+        self._lock = threading.Lock()
+        self._job_params = json.loads(json.dumps(job_params)) # tuples -> lists, as they are stored in file
+
+        self._candidates = {} # url -> candidate harvested but not processed yet
+        self._processed_urls = set()
+        self.downloaded_images_count = 0
+        self.results_start = 0
+        self.is_resumed = self._load()
+
+        mode = 'a' if self.is_resumed else 'w'
+        self._file = io.open(self.path, mode, encoding='utf-8')
+        if not self.is_resumed:
+            self._write({"type": "job", "params": self._job_params, "time": time.time()})
+        else:
+            print(f"Resuming run: {self.downloaded_images_count} images downloaded, {len(self._candidates)} candidates not processed, results start {self.results_start}")
+
+    # Candidates harvested by previous run which weren't processed
+    def getPendingCandidates(self):
+        with self._lock:
+            return list(self._candidates.values())
+
+    def isProcessed(self, url):
+        with self._lock:
+            return url in self._processed_urls
+
+    def addCandidate(self, candidate):
+        with self._lock:
+            if candidate["url"] in self._processed_urls or candidate["url"] in self._candidates:
+                return
+            self._candidates[candidate["url"]] = candidate
+            self._write({"type": "candidate", "candidate": candidate})
+
+    def addProcessed(self, url, outcome):
+        with self._lock:
+            self._candidates.pop(url, None)
+            self._processed_urls.add(url)
+            if outcome == OUTCOME_DOWNLOADED:
+                self.downloaded_images_count += 1
+            self._write({"type": "processed", "url": url, "outcome": outcome})
+
+    def setResultsStart(self, results_start):
+        with self._lock:
+            if results_start > self.results_start:
+                self.results_start = results_start
+                self._write({"type": "position", "results_start": results_start})
+
+    # Finished journal isn't resumed, next run of the same job starts from beginning
+    def finish(self):
+        with self._lock:
+            self._write({"type": "finished", "time": time.time()})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, record):
+        # late record of cancelled run
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    # Returns True if journal contains unfinished run of the same job
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as journal_file:
+                lines = journal_file.readlines()
+        except Exception as ex:
+            print("RunJournal: ", ex)
+            return False
+
+        try:
+            job_record = json.loads(lines[0]) if lines else None
+        except ValueError:
+            return False
+
+        # journal of other job
+        if not job_record or job_record.get("type") != "job" or job_record.get("params") != self._job_params:
+            return False
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line can be partially written if process was killed
+                continue
+
+            if record["type"] == "candidate":
+                candidate = record["candidate"]
+                if candidate["url"] not in self._processed_urls:
+                    candidate["resolution"] = tuple(candidate["resolution"]) if candidate.get("resolution") else None
+                    self._candidates[candidate["url"]] = candidate
+            elif record["type"] == "processed":
+                self._candidates.pop(record["url"], None)
+                self._processed_urls.add(record["url"])
+                if record["outcome"] == OUTCOME_DOWNLOADED:
+                    self.downloaded_images_count += 1
+            elif record["type"] == "position":
+                self.results_start = max(self.results_start, record["results_start"])
+            elif record["type"] == "finished":
+                self._reset()
+                return False
+
+        # last line may be cut, new records should start from new line
+        if lines and not lines[-1].endswith("\n"):
+            with io.open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write("\n")
+
+        return True
+
+    def _reset(self):
+        self._candidates = {}
+        self._processed_urls = set()
+        self.downloaded_images_count = 0
+        self.results_start = 0
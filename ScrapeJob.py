@@ -0,0 +1,92 @@
+import io
+import json
+
+from ImageTransform import createTransformOptions
+from ImageTransform import isTransformEnabled
+from ImageTransform import DEFAULT_TRANSCODE_QUALITY
+
+# Content types enabled by each image extension checkbox
+IMAGE_EXTENSION_CONTENT_TYPES = {
+    "image_extension_jpg": ["image/jpg", "image/jpeg"],
+    "image_extension_png": ["image/png"],
+    "image_extension_gif": ["image/gif"],
+}
+
+# Default values of job fields (same fields MainFrame.getInputValues produces)
+JOB_DEFAULT_VALUES = {
+    "search_query": "",
+    "search_engine": "Google",
+    "save_dir": "",
+    "max_images_count": 10,
+    "min_resolution_width": 0,
+    "min_resolution_height": 0,
+    "max_resolution_width": 7680,
+    "max_resolution_height": 4320,
+    "image_extension_jpg": True,
+    "image_extension_png": True,
+    "image_extension_gif": False,
+    # post-download transform
+    "downscale_oversized": False,
+    "transcode_format": "",
+    "transcode_quality": DEFAULT_TRANSCODE_QUALITY,
+    "strip_metadata": False
+}
+
+def getImageContentTypes(input_values):
+    # jobs from jsonl can list content types directly
+    if input_values.get("content_types"):
+        return list(input_values["content_types"])
+
+    image_contentTypes = []
+    for extension, content_types in IMAGE_EXTENSION_CONTENT_TYPES.items():
+        if input_values.get(extension):
+            image_contentTypes.extend(content_types)
+    return image_contentTypes
+
+# Returns transform options for ImageScrapper.downloadImages or None if images are kept as downloaded
+def getTransformOptions(input_values):
+    values = dict(JOB_DEFAULT_VALUES)
+    values.update(input_values)
+
+    options = createTransformOptions(
+        downscale=bool(values["downscale_oversized"]),
+        format=values["transcode_format"] or None,
+        quality=int(values["transcode_quality"]),
+        strip_metadata=bool(values["strip_metadata"]))
+    return options if isTransformEnabled(options) else None
+
+# Converts input values to ImageScrapper.downloadImages arguments, raises ValueError for invalid job
+def getDownloadArgs(input_values, search_engines):
+    values = dict(JOB_DEFAULT_VALUES)
+    values.update(input_values)
+
+    if values["search_engine"] not in search_engines:
+        raise ValueError("Unknown search engine: " + str(values["search_engine"]))
+
+    if not values["search_query"]:
+        raise ValueError("Search query is empty")
+
+    if not values["save_dir"]:
+        raise ValueError("Save dir is empty")
+
+    image_contentTypes = getImageContentTypes(values)
+    if len(image_contentTypes) == 0:
+        raise ValueError("No image extension selected")
+
+    return {
+        "search_query": values["search_query"],
+        "search_engine": values["search_engine"],
+        "max_images_count": int(values["max_images_count"]),
+        "min_resolution": (int(values["min_resolution_width"]), int(values["min_resolution_height"])),
+        "max_resolution": (int(values["max_resolution_width"]), int(values["max_resolution_height"])),
+        "valid_contentTypes": image_contentTypes,
+        "save_dir": values["save_dir"],
+        "transform": getTransformOptions(values),
+    }
+
+# .iss project file contains one job, .jsonl file contains one job per line
+def readJobsFromFile(path):
+    with io.open(path, 'r', encoding='utf-8') as jobs_file:
+        if path.lower().endswith(".jsonl"):
+            return [json.loads(line) for line in jobs_file if line.strip()]
+        return [json.load(jobs_file)]
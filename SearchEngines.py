@@ -1,20 +1,132 @@
+import os
+import itertools
+import re
 import time
-import requests
-import os.path
+import tempfile
 
-from PIL import ImageFile
-from selenium import webdriver
-from urllib.request import Request, urlopen, urlretrieve
 from hashlib import sha1
+from urllib.parse import quote_plus, urljoin, urlsplit
+
+from HttpPool import getSession
+from HttpPool import abortResponse
+from HostScheduler import getHostScheduler
+from BrowserWaits import waitForCondition
+from Metrics import getRunMetrics
+from ImageProbe import ImageSizeReader
+from ImageProbe import getProbeCache
+from Cancellation import OperationCancelled
+from Cancellation import checkCancelled
+from Cancellation import isCancelled
+from Cancellation import onCancel
 
 # Settings
-USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'
-IMAGE_LOAD_SLEEP_TIME = 0.2
-IMAGE_LOAD_RETRIES = 50 # max amount of retries with delay IMAGE_LOAD_SLEEP_TIME
+IMAGE_LOAD_TIMEOUT = 10 # max seconds to wait for full resolution image, if image will not load, preview will be downloaded
+IMAGE_LINK_TIMEOUT = 2 # max seconds to wait for image link in preview panel
+IMAGE_CHUNK_SIZE = 1024 * 16
+IMAGE_RESOLUTION_MAX_BYTES = 1024 * 1024 # stop looking for resolution if it is not found in first bytes of image
+HTTP_ENGINE_TIMEOUT = 10 # seconds to wait for result page of http search engine
+IMAGE_REQUEST_TIMEOUT = (10, 30) # seconds to connect to image host and to wait for next bytes of image
+IMAGE_MAX_BYTES = 1024 * 1024 * 50 # bigger images are aborted while downloading (None - no limit)
+IMAGE_FSYNC = False # flush downloaded images to disk before they are renamed to final name
+RELEASE_PROCESSED_THUMBNAILS = True # drop image data of processed thumbnails in windowed scrolling
+PROCESSED_THUMBNAIL_ATTRIBUTE = "data-image-scrapper-done" # marks thumbnails processed in windowed scrolling
+IMAGE_DIR_PREFIX_LENGTH = 2 # characters of file hash per subdirectory level of sharded layout (256 subdirectories)
+
+# Outcomes of image candidate processing
+OUTCOME_DOWNLOADED = "downloaded"
+OUTCOME_INVALID_URL = "invalid_url"
+OUTCOME_INVALID_CONTENT_TYPE = "invalid_content_type"
+OUTCOME_TOO_SMALL = "too_small"
+OUTCOME_TOO_BIG = "too_big"
+OUTCOME_TOO_LARGE_FILE = "too_large_file"
+OUTCOME_UNKNOWN_RESOLUTION = "unknown_resolution"
+OUTCOME_DUPLICATE = "duplicate"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_CANCELLED = "cancelled" # run was cancelled while candidate was processed, it stays pending
+OUTCOME_ERROR = "error"
+
+# Returns true when at least one visible full resolution image has real (not data:) url
+IMAGE_LOADED_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0])).some(function(img) {
+    return img.offsetParent !== null && img.src && !img.src.startsWith("data:");
+});
+"""
+
+# Returns true when preview panel contains at least one image link
+IMAGE_LINK_LOADED_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0])).some(function(link) {
+    return link.href && !link.href.startsWith("data:");
+});
+"""
+
+# Reads urls and resolution texts of all preview panels in one call
+# arguments: url selector, url attribute, resolution selector
+PREVIEW_PANELS_SCRIPT = """
+var attribute = arguments[1];
+var urls = Array.from(document.querySelectorAll(arguments[0])).map(function(el) { return el.getAttribute(attribute) || ""; });
+var resolutions = Array.from(document.querySelectorAll(arguments[2])).map(function(el) { return el.innerHTML; });
+return [urls, resolutions];
+"""
+
+# Resolves full resolution url and size of thumbnails using data google embeds in page scripts
+# arguments: thumbnail selector, index of first not processed thumbnail
+# returns array with {url, width, height} or null (when thumbnail can't be resolved) for every new thumbnail.
+# Every script is parsed only once and resolved thumbnails are dropped from data, so calls don't get slower with page size
+GOOGLE_EXTRACT_SCRIPT = """
+var thumbnails = document.querySelectorAll(arguments[0]);
+var start = arguments[1];
+var byId = window.__imageScrapperData || {};
+var re = /\\[0,"([\\w-]+)",\\["https:\\/\\/encrypted-tbn0\\.gstatic\\.com[^"]*",\\d+,\\d+\\],\\["(http[^"]+)",(\\d+),(\\d+)\\]/g;
+Array.from(document.scripts).forEach(function(script) {
+    // last script can still be loading
+    if (script.__imageScrapperParsed || (!script.nextSibling && document.readyState === "loading")) return;
+    script.__imageScrapperParsed = true;
+    var text = script.textContent;
+    if (text.indexOf("AF_initDataCallback") < 0) return;
+    var m;
+    re.lastIndex = 0;
+    while ((m = re.exec(text)) !== null) {
+        try {
+            byId[m[1]] = {url: JSON.parse('"' + m[2] + '"'), height: parseInt(m[3]), width: parseInt(m[4])};
+        } catch (e) {}
+    }
+});
+window.__imageScrapperData = byId;
+var result = [];
+for (var i = start; i < thumbnails.length; i++) {
+    var container = thumbnails[i].closest("[data-id]");
+    var id = container ? container.getAttribute("data-id") : null;
+    result.push(id && byId[id] ? byId[id] : null);
+    if (id) delete byId[id];
+}
+return result;
+"""
+
+# Marks thumbnails as processed, so they aren't selected by windowed scrolling again
+# arguments: thumbnails, attribute, release image data
+MARK_THUMBNAILS_SCRIPT = """
+var attribute = arguments[1];
+var release = arguments[2];
+var blank = "data:image/gif;base64,R0lGODlhAQABAAAAACH5BAEKAAEALAAAAAABAAEAAAICTAEAOw==";
+arguments[0].forEach(function(img) {
+    img.setAttribute(attribute, "");
+    if (release) {
+        // size is kept, so layout and scroll position don't change
+        img.style.width = img.width + "px";
+        img.style.height = img.height + "px";
+        img.removeAttribute("srcset");
+        img.src = blank;
+    }
+});
+"""
 
+# {filter} in urls is replaced with one of "shard_filters" (or "default_filter"),
+# filters narrow results by size, color, type or time, so sharded query gets more results than one query
 SEARCH_ENGINES = {
     "Google" : {
-        "search_url": "https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img",
+        "search_url": "https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img{filter}",
+        "shard_filters": ["&tbs=isz:l", "&tbs=isz:m", "&tbs=ic:gray", "&tbs=ic:trans", "&tbs=itp:photo", "&tbs=itp:clipart", "&tbs=itp:lineart",
+            "&tbs=itp:face", "&tbs=qdr:w", "&tbs=qdr:m", "&tbs=qdr:y"],
         "image_resolution_divider": " × ",
         "selectors": {
             "load_more": "input.mye4qd",
@@ -26,7 +138,9 @@ SEARCH_ENGINES = {
             }
         },
     "DuckDuckGo" : {
-        "search_url": "https://duckduckgo.com/?q={q}&iar=images&iax=images&ia=images",
+        "search_url": "https://duckduckgo.com/?q={q}&iar=images&iax=images&ia=images{filter}",
+        "shard_filters": ["&iaf=size:Large", "&iaf=size:Medium", "&iaf=size:Wallpaper", "&iaf=color:Monochrome", "&iaf=type:photo", "&iaf=type:clipart",
+            "&iaf=type:gif", "&iaf=type:transparent", "&iaf=layout:Wide", "&iaf=layout:Tall", "&iaf=layout:Square"],
         "image_resolution_divider": " × ",
         "selectors": {
             "thumbnail": "img.tile--img__img",    
@@ -34,31 +148,101 @@ SEARCH_ENGINES = {
             "image_link": "a.detail__media__img-link",
             "actual_resolution": "div.c-detail__filemeta",
             }
+        },
+    # engines with "type": "http" are processed without browser, results are taken from json api
+    "DuckDuckGo HTTP" : {
+        "type": "http",
+        "search_url": "https://duckduckgo.com/?q={q}&iar=images&iax=images&ia=images",
+        "api_url": "https://duckduckgo.com/i.js?l=us-en&o=json&q={q}&vqd={vqd}&f={filter}&p=-1",
+        # size, color, type, layout, license
+        "default_filter": ",,,,,",
+        "shard_filters": ["size:Large,,,,,", "size:Medium,,,,,", "size:Wallpaper,,,,,", ",color:Monochrome,,,,", ",,type:photo,,,", ",,type:clipart,,,",
+            ",,type:gif,,,", ",,type:transparent,,,", ",,,layout:Wide,,", ",,,layout:Tall,,", ",,,layout:Square,,"],
+        "vqd_regex": r"vqd=[\"']?([\d-]+)",
+        },
+    # engines with "type": "multi" run listed engines concurrently and merge their results
+    "Multi" : {
+        "type": "multi",
+        "engines": ["Google", "DuckDuckGo HTTP"],
         }
     }
 
-def getTrueImageResolution(url):
-    file = urlopen(Request(url, headers={'User-Agent': USER_AGENT}))
-    p = ImageFile.Parser()
-
-    while True:
-        data = file.read(1024)
-        if not data:
+# Use as context manager, request waits for its turn in per host scheduler and transient failures are retried,
+# cancelled cancel_token aborts waiting and reading of body (Cancellation.OperationCancelled is raised)
+def openImageStream(url, headers=None, cancel_token=None):
+    # User-Agent, keep-alive and certificate settings are applied by shared HttpPool session
+    session = getSession()
+    return getHostScheduler().open(url, lambda: session.get(url, headers=headers, allow_redirects=True, stream=True, timeout=IMAGE_REQUEST_TIMEOUT),
+        cancel_token)
+
+def getResponseContentType(response):
+    content_type = response.headers.get('content-type')
+    if not content_type:
+        return None
+    return content_type.split(';')[0].strip().lower()
+
+def getResponseContentLength(response):
+    try:
+        return int(response.headers.get('content-length'))
+    except (TypeError, ValueError):
+        return None
+
+def isContentLengthValid(content_length, max_bytes):
+    return not max_bytes or content_length is None or content_length <= max_bytes
+
+# Feeds first chunks of image to header parser until it yields a size
+# Returns resolution (or None) and already read chunks, so they can be written to disk later
+def readImageResolution(chunks):
+    reader = ImageSizeReader()
+    read_chunks = []
+
+    for data in chunks:
+        read_chunks.append(data)
+        if reader.feed(data):
+            return reader.size, read_chunks
+        if reader.read_bytes >= IMAGE_RESOLUTION_MAX_BYTES:
             break
-        p.feed(data)
-        if p.image:
-            return p.image.size
 
-    file.close()
-    return None
+    return None, read_chunks
 
-def getImageContentType(url):
-    response = requests.head(url, verify=False)
-    return response.headers['content-type']
+# Streams chunks to temporary file next to saveFilePath and renames it when all chunks are written,
+# so interrupted download never leaves truncated image under final name.
+# Returns amount of written bytes or None if image is bigger than max_bytes (nothing is saved),
+# cancelled cancel_token stops writing and removes temporary file, file_hash (hashlib object) is updated with written bytes
+def writeImageChunks(saveFilePath, chunks, max_bytes=None, fsync=IMAGE_FSYNC, cancel_token=None, file_hash=None):
+    directory, file_name = os.path.split(saveFilePath)
+    # dot prefix hides temporary file from content index and downloaded files lookup
+    fd, temp_path = tempfile.mkstemp(suffix=".part", prefix="." + file_name + ".", dir=directory or ".")
+    written_bytes = 0
+    is_too_large = False
 
-def downloadImage(url, saveFilePath):
-    response = requests.get(url, headers={'User-Agent': USER_AGENT}, allow_redirects=True, verify=False)
-    open(saveFilePath, 'wb').write(response.content)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for data in chunks:
+                checkCancelled(cancel_token)
+                written_bytes += len(data)
+                if max_bytes and written_bytes > max_bytes:
+                    is_too_large = True
+                    break
+                file.write(data)
+                if file_hash:
+                    file_hash.update(data)
+
+            if fsync and not is_too_large:
+                file.flush()
+                os.fsync(file.fileno())
+
+        if is_too_large:
+            os.remove(temp_path)
+            return None
+
+        checkCancelled(cancel_token)
+        os.replace(temp_path, saveFilePath)
+        return written_bytes
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 def getStringHash(strToHash):
     return sha1(strToHash.encode('utf-8')).hexdigest()
@@ -66,21 +250,44 @@ def getStringHash(strToHash):
 def getImageFileName(imgUrl, imgContentType):
     return getStringHash(imgUrl) + "." + imgContentType.replace("image/", "")
 
-def isResolutionValid(img_resolution, min_resolution, max_resolution):
+# Directory of image in save dir: save dir itself for flat layout (dir_levels = 0),
+# otherwise subdirectories named by prefixes of url hash, e.g. save_dir/3f/a2 for 2 levels
+def getImageDir(imgUrl, save_dir, dir_levels=0):
+    url_hash = getStringHash(imgUrl)
+    prefixes = [url_hash[level * IMAGE_DIR_PREFIX_LENGTH:(level + 1) * IMAGE_DIR_PREFIX_LENGTH] for level in range(dir_levels)]
+    return os.path.join(save_dir, *prefixes)
+
+# Returns paths of files already saved for image url with one of content types (extension depends on content type).
+# Every extension is checked with os.path.exists, listing of directory with 100k+ images would take longer than request
+def findDownloadedImageFiles(imgUrl, save_dir, contentTypes, dir_levels=0):
+    image_dir = getImageDir(imgUrl, save_dir, dir_levels)
+    file_paths = [os.path.join(image_dir, getImageFileName(imgUrl, contentType)) for contentType in dict.fromkeys(contentTypes)]
+    return [file_path for file_path in file_paths if os.path.exists(file_path)]
+
+# Returns None if resolution is valid, otherwise outcome describing why it isn't
+def getResolutionRejectReason(img_resolution, min_resolution, max_resolution):
     if not img_resolution:
-        return False
+        return OUTCOME_UNKNOWN_RESOLUTION
 
     # Check if image resolution bigger than minResolution
     if (img_resolution[0] < min_resolution[0]) or (img_resolution[1] < min_resolution[1]):
-        print("NOT VALID (Lower resolution): " + str(img_resolution))
-        return False
+        return OUTCOME_TOO_SMALL
 
     # Check if image resolution smaller than maxResolution
     if (img_resolution[0] > max_resolution[0]) or (img_resolution[1] > max_resolution[1]):
+        return OUTCOME_TOO_BIG
+
+    return None
+
+def isResolutionValid(img_resolution, min_resolution, max_resolution):
+    reject_reason = getResolutionRejectReason(img_resolution, min_resolution, max_resolution)
+
+    if reject_reason == OUTCOME_TOO_SMALL:
+        print("NOT VALID (Lower resolution): " + str(img_resolution))
+    elif reject_reason == OUTCOME_TOO_BIG:
         print("NOT VALID (Bigger resolution): " + str(img_resolution))
-        return False        
 
-    return True
+    return not reject_reason
 
 def isContentTypeValid(img_contentType, valid_contentTypes):
     if not img_contentType:
@@ -88,108 +295,241 @@ def isContentTypeValid(img_contentType, valid_contentTypes):
 
     return img_contentType in valid_contentTypes
 
-def isImageValid(img_url, img_resolution, min_resolution, max_resolution, img_contentType, valid_contentTypes):
-    if (not img_url):
-        return False
-   
-    if not isContentTypeValid(img_contentType, valid_contentTypes):
-        return False
-
-    if not isResolutionValid(img_resolution, min_resolution, max_resolution):
-        return False
-
-    return True
-
-def tryDownloadImage(img_url, search_engine, img_resolution, min_resolution, max_resolution, valid_contentTypes, save_dir):
-    try:
-        img_contentType = getImageContentType(img_url)
-
-        if isImageValid(img_url, img_resolution, min_resolution, max_resolution, img_contentType, valid_contentTypes):
-            image_fileName = getImageFileName(img_url, img_contentType)
-            save_filePath = os.path.join(save_dir, image_fileName)
-
-            if os.path.exists(save_filePath):
-                return False
-
-            # check resolution of image by url (because google can display cached resolution, but link can be new)
-            if not isResolutionValid(getTrueImageResolution(img_url), min_resolution, max_resolution):
-                return False
+def createDownloadResult(outcome, img_contentType=None, true_resolution=None, save_filePath=None, is_requested=True, file_size=None, bytes_per_second=None,
+                         content_hash=None):
+    return {
+        "outcome": outcome,
+        "content_type": img_contentType,
+        "resolution": true_resolution,
+        "file_path": save_filePath,
+        # False when outcome was decided without any request
+        "is_requested": is_requested,
+        # size and download speed of saved file
+        "file_size": file_size,
+        "bytes_per_second": bytes_per_second,
+        # sha1 of saved file (None if it wasn't computed while writing)
+        "content_hash": content_hash
+    }
 
-            downloadImage(img_url, save_filePath)
-            print(img_url + " $$ " + image_fileName)
-            return True 
-    except Exception as ex:        
-        print("tryDownloadImage: ", ex)
+# Validates and downloads image with single request, returns result with outcome, content type and true resolution.
+# Raises Cancellation.OperationCancelled when cancel_token is cancelled (partial file is removed).
+# dir_levels - subdirectory levels of save dir layout (see getImageDir)
+def downloadImageCandidate(img_url, img_resolution, min_resolution, max_resolution, valid_contentTypes, save_dir, max_bytes=IMAGE_MAX_BYTES, fsync=IMAGE_FSYNC,
+                           cancel_token=None, dir_levels=0):
+    # reported resolution and already saved files can be checked without any request
+    if not img_url:
+        return createDownloadResult(OUTCOME_INVALID_URL, is_requested=False)
 
-    return False
+    if not isResolutionValid(img_resolution, min_resolution, max_resolution):
+        return createDownloadResult(getResolutionRejectReason(img_resolution, min_resolution, max_resolution), is_requested=False)
+
+    downloaded_files = findDownloadedImageFiles(img_url, save_dir, valid_contentTypes, dir_levels)
+    if downloaded_files:
+        return createDownloadResult(OUTCOME_DUPLICATE, save_filePath=downloaded_files[0], is_requested=False)
+
+    # true resolution which was already read from the same url
+    is_cached, cached_resolution = getProbeCache().get(img_url)
+    if is_cached and cached_resolution and not isResolutionValid(cached_resolution, min_resolution, max_resolution):
+        return createDownloadResult(getResolutionRejectReason(cached_resolution, min_resolution, max_resolution), true_resolution=cached_resolution, is_requested=False)
+
+    # single request: content type from headers, true resolution from first chunks, rest of body to disk
+    checkCancelled(cancel_token)
+    metrics = getRunMetrics()
+    start_time = time.monotonic()
+    # image_download - whole request (failed ones too), image_request - until response headers
+    with metrics.measure("image_download"), openImageStream(img_url, cancel_token=cancel_token) as response:
+        metrics.addStageTime("image_request", time.monotonic() - start_time)
+        response.raise_for_status()
+        img_contentType = getResponseContentType(response)
+
+        if not isContentTypeValid(img_contentType, valid_contentTypes):
+            return createDownloadResult(OUTCOME_INVALID_CONTENT_TYPE, img_contentType)
+
+        # declared size is checked before any byte of body is read
+        if not isContentLengthValid(getResponseContentLength(response), max_bytes):
+            print("NOT VALID (Bigger file): " + str(getResponseContentLength(response)) + " bytes")
+            return createDownloadResult(OUTCOME_TOO_LARGE_FILE, img_contentType)
+
+        image_fileName = getImageFileName(img_url, img_contentType)
+        image_dir = getImageDir(img_url, save_dir, dir_levels)
+        save_filePath = os.path.join(image_dir, image_fileName)
+
+        if os.path.exists(save_filePath):
+            return createDownloadResult(OUTCOME_DUPLICATE, img_contentType, save_filePath=save_filePath)
+
+        # check resolution of image by url (because google can display cached resolution, but link can be new)
+        chunks = response.iter_content(IMAGE_CHUNK_SIZE)
+        with metrics.measure("resolution_probe"):
+            true_resolution, read_chunks = readImageResolution(chunks)
+        getProbeCache().put(img_url, true_resolution)
+        if not isResolutionValid(true_resolution, min_resolution, max_resolution):
+            return createDownloadResult(getResolutionRejectReason(true_resolution, min_resolution, max_resolution), img_contentType, true_resolution)
+
+        # size isn't always declared, body is also counted (and hashed) while it is written
+        file_hash = sha1()
+        with metrics.measure("image_write"):
+            if dir_levels:
+                os.makedirs(image_dir, exist_ok=True)
+            file_size = writeImageChunks(save_filePath, itertools.chain(read_chunks, chunks), max_bytes, fsync, cancel_token, file_hash)
+        if file_size is None:
+            print("NOT VALID (Bigger file): more than " + str(max_bytes) + " bytes")
+            return createDownloadResult(OUTCOME_TOO_LARGE_FILE, img_contentType, true_resolution)
+
+        bytes_per_second = file_size / max(time.monotonic() - start_time, 1e-6)
+        print(f"{img_url} $$ {image_fileName} ({file_size // 1024} KB, {bytes_per_second / 1024:.0f} KB/s)")
+        return createDownloadResult(OUTCOME_DOWNLOADED, img_contentType, true_resolution, save_filePath, file_size=file_size, bytes_per_second=bytes_per_second,
+            content_hash=file_hash.hexdigest())
+
+def createImageCandidate(img_url, img_resolution, search_engine):
+    return {
+        "url": img_url,
+        "resolution": img_resolution,
+        "search_engine": search_engine
+    }
 
-# Returns True if image was downloaded
-def processImageGoogle(wd, search_engine, min_resolution, max_resolution, valid_contentTypes, save_dir):
+def parseImageResolution(resolution_text, search_engine):
+    resolution = resolution_text.split(SEARCH_ENGINES[search_engine]["image_resolution_divider"])
+    return (int(resolution[0]), int(resolution[1]))
+
+# Returns list of image candidates from the opened preview
+def findImageCandidatesGoogle(wd, search_engine, cancel_token=None):
+    # wait until full resolution image replaces data: preview (at most IMAGE_LOAD_TIMEOUT seconds)
+    # if image will not load, preview will be downloaded
+    waitForCondition("image_load", 
+        lambda: wd.execute_script(IMAGE_LOADED_SCRIPT, SEARCH_ENGINES[search_engine]["selectors"]["image"]), 
+        IMAGE_LOAD_TIMEOUT, cancel_token=cancel_token)
+
+    # actual_images would be array with 3 elements (prev, current, next, but random order)
+    return readPreviewPanels(wd, search_engine, SEARCH_ENGINES[search_engine]["selectors"]["image"], "src")
+
+# Returns list of image candidates from the opened preview
+def findImageCandidatesDuckDuckGo(wd, search_engine, cancel_token=None):
+    waitForCondition("image_link", 
+        lambda: wd.execute_script(IMAGE_LINK_LOADED_SCRIPT, SEARCH_ENGINES[search_engine]["selectors"]["image_link"]), 
+        IMAGE_LINK_TIMEOUT, cancel_token=cancel_token)
+
+    # actual_image_links would be array with 3 elements (prev, current, next, but random order)
+    return readPreviewPanels(wd, search_engine, SEARCH_ENGINES[search_engine]["selectors"]["image_link"], "href")
+
+# Returns candidates from all opened preview panels, urls and resolutions are read with one script call
+def readPreviewPanels(wd, search_engine, url_selector, url_attribute):
+    actual_urls, actual_resolutions = wd.execute_script(PREVIEW_PANELS_SCRIPT, url_selector, url_attribute, SEARCH_ENGINES[search_engine]["selectors"]["actual_resolution"])
+
+    if len(actual_urls) != len(actual_resolutions):
+        print("ERROR: Length of actual_urls not equal to length of actual_resolutions")
+        return []
+
+    candidates = []
+    for img_url, actual_resolution in zip(actual_urls, actual_resolutions):
+        if not img_url or img_url.startswith("data:"):
+            continue
+
+        resolution = parseImageResolution(actual_resolution, search_engine)
+        candidates.append(createImageCandidate(img_url, resolution, search_engine))
+
+    return candidates
+
+# Selector of thumbnails which weren't marked by markThumbnailsProcessed
+def getUnprocessedSelector(selector):
+    return ", ".join(part.strip() + ":not([" + PROCESSED_THUMBNAIL_ATTRIBUTE + "])" for part in selector.split(","))
+
+def markThumbnailsProcessed(wd, thumbnails):
+    if thumbnails:
+        wd.execute_script(MARK_THUMBNAILS_SCRIPT, thumbnails, PROCESSED_THUMBNAIL_ATTRIBUTE, RELEASE_PROCESSED_THUMBNAILS)
+
+# Returns list aligned with thumbnails[results_start:], candidate or None for thumbnails which should be clicked
+# (windowed scrolling passes selector of unprocessed thumbnails and results_start 0)
+def extractImageCandidatesGoogle(wd, search_engine, results_start, thumbnail_selector=None):
+    thumbnail_selector = thumbnail_selector or SEARCH_ENGINES[search_engine]["selectors"]["thumbnail"]
+    candidates = []
+    for item in wd.execute_script(GOOGLE_EXTRACT_SCRIPT, thumbnail_selector, results_start) or []:
+        if item and item.get("url") and not item["url"].startswith("data:"):
+            candidates.append(createImageCandidate(item["url"], (int(item["width"]), int(item["height"])), search_engine))
+        else:
+            candidates.append(None)
+    return candidates
+
+def isHttpSearchEngine(search_engine):
+    return SEARCH_ENGINES[search_engine].get("type") == "http"
+
+def isMultiSearchEngine(search_engine):
+    return SEARCH_ENGINES[search_engine].get("type") == "multi"
+
+# Filters of engine, default (not narrowing) filter is the first one
+def getSearchFilters(search_engine):
+    return [SEARCH_ENGINES[search_engine].get("default_filter", "")] + SEARCH_ENGINES[search_engine].get("shard_filters", [])
+
+# Formats url of engine ("search_url", "api_url") with filter (None - default filter) and other params
+def formatSearchUrl(search_engine, url_name, search_filter=None, **params):
+    if search_filter is None:
+        search_filter = SEARCH_ENGINES[search_engine].get("default_filter", "")
+    return SEARCH_ENGINES[search_engine][url_name].format(filter=search_filter, **params)
+
+# Key of url for deduplication of candidates found by different engines:
+# scheme, default port, fragment and case of host don't change the image
+def normalizeImageUrl(url):
     try:
-        # wait for load of image IMAGE_LOAD_RETRIES * IMAGE_LOAD_SLEEP_TIME seconds
-        # if image will not load, preview will be downloaded
-        for _ in range(IMAGE_LOAD_RETRIES):
-            time.sleep(IMAGE_LOAD_SLEEP_TIME)
-            loading_progressbars = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["loading_progressbar"])
-
-            for loading_progressbar in loading_progressbars:
-                # at least one progress bar visible
-                if not loading_progressbar.get_attribute("style"):
-                    break
-            else:    
-                # all loading progressbars are hidden   
-                break                                          
-
-        # actual_images would be array with 3 elements (prev, current, next, but random order)
-        actual_images = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["image"]) 
-        actual_resolutions = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["actual_resolution"])               
-        
-        if len(actual_images) != len(actual_resolutions):
-            print("ERROR: Length of actual_images not equal to length of actual_resolutions")
-            return False
-
-        for actual_image, actual_resolution in zip(actual_images, actual_resolutions):          
-            img_url = actual_image.get_attribute("src")
-
-            if img_url.startswith("data:"):
-                # print("Skip data: image")
-                continue
-
-            resolution = actual_resolution.get_attribute("innerHTML").split(SEARCH_ENGINES[search_engine]["image_resolution_divider"])
-            resolution[0], resolution[1] = int(resolution[0]), int(resolution[1])
-
-            if tryDownloadImage(img_url, search_engine, resolution, min_resolution, max_resolution, valid_contentTypes, save_dir):
-                return True
-    except Exception as ex:
-        print("processImageGoogle: ", ex)   
-
-    return False
-
-# Returns True if image was downloaded
-def processImageDuckDuckGo(wd, search_engine, min_resolution, max_resolution, valid_contentTypes, save_dir):   
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+
+    if parts.scheme.lower() not in ("http", "https"):
+        return url
+
+    netloc = parts.hostname or ""
+    if port and port not in (80, 443):
+        netloc += ":" + str(port)
+    return "//" + netloc + (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+# Returns response with whole body read, cancelled cancel_token aborts reading with OperationCancelled
+def getSearchPage(session, url, headers=None, cancel_token=None):
+    response = session.get(url, headers=headers, stream=True, timeout=HTTP_ENGINE_TIMEOUT)
     try:
-        time.sleep(IMAGE_LOAD_SLEEP_TIME)
-  
-        # actual_images would be array with 3 elements (prev, current, next, but random order)
-        actual_image_links = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["image_link"]) 
-        actual_resolutions = wd.find_elements_by_css_selector(SEARCH_ENGINES[search_engine]["selectors"]["actual_resolution"])               
-        
-        if len(actual_image_links) != len(actual_resolutions):
-            print("ERROR: Length of actual_image_links not equal to length of actual_resolutions")
-            return False
-
-        for actual_image_link, actual_resolution in zip(actual_image_links, actual_resolutions):              
-            img_url = actual_image_link.get_attribute("href")
-
-            if img_url.startswith("data:"):
-                continue
-
-            resolution = actual_resolution.get_attribute("innerHTML").split(SEARCH_ENGINES[search_engine]["image_resolution_divider"])
-            resolution[0], resolution[1] = int(resolution[0]), int(resolution[1])
-
-            if tryDownloadImage(img_url, search_engine, resolution, min_resolution, max_resolution, valid_contentTypes, save_dir):
-                return True
+        with onCancel(cancel_token, lambda: abortResponse(response)):
+            # body is read and cached by response
+            response.content
     except Exception as ex:
-        print("processImageDuckDuckGo: ", ex)   
-
-    return False
\ No newline at end of file
+        response.close()
+        if isCancelled(cancel_token):
+            raise OperationCancelled() from ex
+        raise
+    return response
+
+# Yields lists of image candidates, one list per page of json results (narrowed by search_filter of engine).
+# Stops when cancel_token is cancelled (OperationCancelled is raised if page was being loaded)
+def findImageCandidatesDuckDuckGoHttp(search_query, search_engine, cancel_token=None, search_filter=None):
+    session = getSession()
+    query = quote_plus(search_query)
+
+    # search page contains vqd token which is required by json api
+    search_url = formatSearchUrl(search_engine, "search_url", search_filter, q=query)
+    with getRunMetrics().measure("search_page"):
+        response = getSearchPage(session, search_url, cancel_token=cancel_token)
+        response.raise_for_status()
+
+    vqd_match = re.search(SEARCH_ENGINES[search_engine]["vqd_regex"], response.text)
+    if not vqd_match:
+        print("ERROR: vqd token not found on search page")
+        return
+    vqd = vqd_match.group(1)
+
+    page_url = formatSearchUrl(search_engine, "api_url", search_filter, q=query, vqd=vqd)
+    while page_url and not isCancelled(cancel_token):
+        with getRunMetrics().measure("search_page"):
+            response = getSearchPage(session, page_url, headers={'Referer': search_url}, cancel_token=cancel_token)
+            response.raise_for_status()
+            data = response.json()
+
+        candidates = []
+        for result in data.get("results", []):
+            if result.get("image") and result.get("width") and result.get("height"):
+                candidates.append(createImageCandidate(result["image"], (int(result["width"]), int(result["height"])), search_engine))
+        yield candidates
+
+        # "next" is relative url of the next page without vqd token
+        if not data.get("next"):
+            break
+        page_url = urljoin(page_url, data["next"])
+        if "vqd=" not in page_url:
+            page_url += "&vqd=" + vqd
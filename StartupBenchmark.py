@@ -0,0 +1,103 @@
+import io
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Settings
+# entry points and modules which scripts import before they know what they will do
+STARTUP_MODULES = ["MainFrame", "ImageScrapper", "BatchRunner", "ScrapeJob", "JobServer", "JobWorker"]
+# libraries loaded on first use only, importing startup modules mustn't load them
+LAZY_MODULES = ["selenium", "requests", "urllib3", "PIL"]
+DEFAULT_REPEATS = 5
+DEFAULT_MAX_IMPORT_MS = 150 # per module, whole import including dependencies
+MIN_SLOWDOWN_MS = 5 # smaller growth against baseline is noise of tiny imports
+
+# Imports module in fresh interpreter with -X importtime.
+# Returns (cumulative import time of module in ms, names of all imported modules), raises ImportError if import failed
+def measureImport(module_name):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module_name],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "import failed")
+
+    import_time = None
+    imported_modules = set()
+    # import time: self [us] | cumulative | imported package
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit():
+            continue # header line
+        imported_modules.add(name)
+        if name == module_name:
+            import_time = int(cumulative) / 1000
+
+    return import_time, imported_modules
+
+def isLazyModuleLoaded(imported_modules, lazy_module):
+    return any(name == lazy_module or name.startswith(lazy_module + ".") for name in imported_modules)
+
+# Returns result of module: best import time of repeats and lazy modules it loaded (None if module can't be imported here)
+def runStartupBenchmark(module_name, repeats=DEFAULT_REPEATS):
+    try:
+        measurements = [measureImport(module_name) for _ in range(max(1, repeats))]
+    except ImportError as ex:
+        print(f"{module_name}: skipped ({ex})")
+        return None
+
+    import_time = min(measurement[0] for measurement in measurements)
+    loaded_lazy_modules = [lazy_module for lazy_module in LAZY_MODULES if isLazyModuleLoaded(measurements[0][1], lazy_module)]
+    print(f"{module_name}: {import_time:.1f}ms" + (f", loads {', '.join(loaded_lazy_modules)}" if loaded_lazy_modules else ""))
+    return {
+        "module": module_name,
+        "import_time_ms": import_time,
+        "loaded_lazy_modules": loaded_lazy_modules
+    }
+
+# Returns descriptions of results which load lazy modules, exceed max_import_ms or are slower than baseline by more than max_slowdown
+def findStartupRegressions(results, max_import_ms, baseline_results=None, max_slowdown=0.2):
+    baseline = {r["module"]: r for r in baseline_results or []}
+    regressions = []
+    for result in results:
+        if result["loaded_lazy_modules"]:
+            regressions.append(f"{result['module']} loads {', '.join(result['loaded_lazy_modules'])} at import")
+        if result["import_time_ms"] > max_import_ms:
+            regressions.append(f"{result['module']} imports in {result['import_time_ms']:.1f}ms (max {max_import_ms}ms)")
+
+        baseline_result = baseline.get(result["module"])
+        if baseline_result and result["import_time_ms"] > max(baseline_result["import_time_ms"] * (1 + max_slowdown), baseline_result["import_time_ms"] + MIN_SLOWDOWN_MS):
+            regressions.append(f"{result['module']} imports in {result['import_time_ms']:.1f}ms, baseline {baseline_result['import_time_ms']:.1f}ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time of entry points with -X importtime, exit with 1 if startup regressed")
+    parser.add_argument("-m", "--modules", nargs="+", default=STARTUP_MODULES, help="modules to import")
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS, help="imports per module, the fastest one is reported")
+    parser.add_argument("--max-ms", type=float, default=DEFAULT_MAX_IMPORT_MS, help="allowed import time of every module")
+    parser.add_argument("-o", "--output", help="write results to json file")
+    parser.add_argument("--baseline", help="json file with results of previous benchmark to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="allowed import time growth against baseline")
+    args = parser.parse_args(argv)
+
+    results = [result for result in (runStartupBenchmark(module_name, args.repeats) for module_name in args.modules) if result]
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=4)
+
+    baseline_results = None
+    if args.baseline:
+        with io.open(args.baseline, 'r', encoding='utf-8') as baseline:
+            baseline_results = json.load(baseline)
+
+    regressions = findStartupRegressions(results, args.max_ms, baseline_results, args.max_slowdown)
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
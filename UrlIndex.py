@@ -0,0 +1,82 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Settings
+DEFAULT_URL_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".ImageScrapper", "url_index.sqlite3")
+SQLITE_TIMEOUT = 30 # seconds to wait while other process writes to index
+
+# Every url ever processed with its content type, true resolution and outcome.
+# Shared across runs, save directories and processes (sqlite in WAL mode)
+class UrlIndex:
+    def __init__(self, path=DEFAULT_URL_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                content_type TEXT,
+                width INTEGER,
+                height INTEGER,
+                outcome TEXT NOT NULL,
+                file_path TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self._connection.commit()
+
+    # Returns dict with stored url info or None if url was never seen
+    def get(self, url):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_type, width, height, outcome, file_path, updated_at FROM urls WHERE url = ?", (url,)).fetchone()
+
+        if not row:
+            return None
+
+        return {
+            "url": url,
+            "content_type": row[0],
+            "resolution": (row[1], row[2]) if row[1] is not None and row[2] is not None else None,
+            "outcome": row[3],
+            "file_path": row[4],
+            "updated_at": row[5]
+        }
+
+    def add(self, url, outcome, content_type=None, resolution=None, file_path=None):
+        width, height = resolution if resolution else (None, None)
+
+        with self._lock:
+            # don't forget known content type and resolution if new result doesn't have them (e.g. request error)
+            self._connection.execute("""
+                INSERT INTO urls (url, content_type, width, height, outcome, file_path, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    content_type = COALESCE(excluded.content_type, content_type),
+                    width = COALESCE(excluded.width, width),
+                    height = COALESCE(excluded.height, height),
+                    outcome = excluded.outcome,
+                    file_path = COALESCE(excluded.file_path, file_path),
+                    updated_at = excluded.updated_at""",
+                (url, content_type, width, height, outcome, file_path, time.time()))
+            self._connection.commit()
+
+    def remove(self, url):
+        with self._lock:
+            self._connection.execute("DELETE FROM urls WHERE url = ?", (url,))
+            self._connection.commit()
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()